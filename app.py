@@ -1,156 +1,312 @@
+import functools
+import os
+import time
+
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Only the light helpers are imported up front. pandas and the analytics are
+# imported once a file is uploaded, plotly when the first chart is drawn, so the
+# upload page comes up without waiting on them.
+from dataset_store import STORE_DIR, is_saved, list_datasets, open_sales, save_sales
+from support import DatasetRegistry, LRUCache, StageProfiler, content_hash, get_or_build
 
 # Set Streamlit page config
 st.set_page_config(page_title="Your Sales Dashboard", layout="wide")
 
-# Function to load CSV
+# Datasets are shared by every session that has them open (see DatasetRegistry).
+# Once nobody has one open it's kept DATASET_IDLE_SECONDS in case someone comes
+# back, while unopened datasets fit in CACHE_MAX_MB. A session that hasn't rerun
+# for SESSION_LEASE_SECONDS no longer counts as having its dataset open.
+CACHE_MAX_MB = int(os.environ.get("DASHBOARD_CACHE_MB", "1024"))
+DATASET_IDLE_SECONDS = int(os.environ.get("DASHBOARD_DATASET_IDLE_SECONDS", "600"))
+SESSION_LEASE_SECONDS = int(os.environ.get("DASHBOARD_SESSION_LEASE_SECONDS", "1800"))
+
+# The Units Sold vs Profit scatter switches to WebGL above SCATTER_WEBGL_ROWS points;
+# SCATTER_SAMPLE_ROWS is how many points the "Sample" view keeps
+SCATTER_WEBGL_ROWS = int(os.environ.get("DASHBOARD_SCATTER_WEBGL_ROWS", "10000"))
+SCATTER_SAMPLE_ROWS = int(os.environ.get("DASHBOARD_SCATTER_SAMPLE_ROWS", "50000"))
+
+# Built charts are kept (see cached_figure) while they fit in FIGURE_CACHE_MB, shared
+# by all sessions; a point-per-sale scatter of a big file can take tens of MB on its own.
+# The chatbot's per-day indexes and query results are small and kept by count.
+FIGURE_CACHE_MB = int(os.environ.get("DASHBOARD_FIGURE_CACHE_MB", "256"))
+FIGURE_CACHE_ENTRIES = int(os.environ.get("DASHBOARD_FIGURE_CACHE_ENTRIES", "200"))
+
+# Time every section of the page and show it in a debug panel. Off unless
+# DASHBOARD_PROFILE=1 is set or the page is opened with ?profile=1. Memory is
+# only measured with DASHBOARD_PROFILE_MEMORY=1 too: tracemalloc slows down every
+# session on the server while it runs, so a visitor can't switch it on from a URL.
+PROFILE = os.environ.get("DASHBOARD_PROFILE", "0") == "1" or st.query_params.get("profile") == "1"
+PROFILE_MEMORY = os.environ.get("DASHBOARD_PROFILE_MEMORY", "0") == "1"
+profiler = StageProfiler(enabled=PROFILE, trace_memory=PROFILE_MEMORY,
+                         timings=st.session_state.setdefault("_stage_timings", {}))
+
+
+@st.cache_resource
+def get_dataset_registry():
+    return DatasetRegistry(sizeof=lambda data: data.nbytes, max_size=CACHE_MAX_MB * 1024 * 1024,
+                           idle_seconds=DATASET_IDLE_SECONDS, lease_seconds=SESSION_LEASE_SECONDS)
+
+
+@st.cache_resource
+def get_figure_cache():
+    def sizeof(entry):
+        from charts import figure_nbytes
+
+        return figure_nbytes(entry[0])
+
+    return LRUCache(FIGURE_CACHE_MB * 1024 * 1024, sizeof=sizeof)
+
+
+@st.cache_resource
+def get_daily_index_cache():
+    return LRUCache(FIGURE_CACHE_ENTRIES, sizeof=lambda index: 1)
+
+
+@st.cache_resource
+def get_query_cache():
+    return LRUCache(FIGURE_CACHE_ENTRIES, sizeof=lambda result: 1)
+
+
+# Who holds datasets in the registry: this browser session
+def session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "script"
+
+
+# Hash the upload once per file and remember it, so reruns don't rehash big files
+def file_hash(uploaded_file):
+    hashes = st.session_state.setdefault("_file_hashes", {})
+    file_id = getattr(uploaded_file, "file_id", None)
+    if file_id is not None and file_id in hashes:
+        return hashes[file_id]
+    digest = content_hash(uploaded_file.getvalue())
+    if file_id is not None:
+        hashes[file_id] = digest
+    return digest
+
+
+# Function to load CSV (parsed once per distinct file across all sessions, with a progress bar for big ones)
 def load_data(uploaded_file):
     if uploaded_file is not None:
-        df = pd.read_csv(uploaded_file)
-        return df
+        bar = None
+
+        def show_progress(done, rows):
+            nonlocal bar
+            if bar is None:
+                bar = st.progress(0.0, text="Reading your file...")
+            bar.progress(done, text=f"Reading your file... {rows:,} rows so far")
+
+        key = file_hash(uploaded_file)
+        data = get_dataset_registry().acquire(key, session_id(),
+                                              lambda: load_sales(uploaded_file, key, progress=show_progress))
+        if bar is not None:
+            bar.empty()
+        return data
     return None
 
+
+# A saved dataset by key: the same shared copy if any session already has it
+# open (as an upload or from the store), otherwise opened from the dataset store
+def open_saved(key):
+    return get_dataset_registry().acquire(key, session_id(), lambda: open_sales(key))
+
+
+# Reuse a chart built earlier for the same dataset, filters and chart settings.
+# `build` returns (figure, caption) and only runs on a cache miss.
+def cached_figure(filter_key, name, build, *settings):
+    return get_or_build(get_figure_cache(), (*filter_key, name, *settings), build)
+
+
+# Per-day totals for the chatbot's date questions, built once per filter state
+def get_daily_index(filter_key, cube):
+    return get_or_build(get_daily_index_cache(), filter_key, lambda: DailyIndex(cube))
+
+
+# Chatbot query results, cached per dataset + filters + normalised query
+def cached_query(filter_key, cube, query):
+    return get_or_build(get_query_cache(), (*filter_key, query), lambda: run_query(cube, query))
+
+
+# The chart area reruns on its own when its widgets (zoom, scatter settings) change
+@st.fragment
+def show_charts(data, filtered_cube, filter_key, top, date_range, product_filter):
+    with profiler.stage("import: charts"):
+        from charts import (
+            ROW_COLUMNS, category_figure, profit_figure, scatter_figure, top_products_figure, trend_figure,
+        )
+
+    # Raw rows are only pulled if a chart that needs them isn't cached
+    filtered_rows = functools.cache(lambda: data.rows(date_range[0], date_range[1], product_filter, ROW_COLUMNS))
+
+    # --- Visualization 1: Interactive Sales Over Time ---
+    st.write("### How Your Sales Look Over Time")
+    st.write("Zoom in, hover for details—this shows your daily sales!")
+    zoom = None
+    if TREND_DOWNSAMPLE != "off" and filtered_cube["Date"].nunique() > TREND_MAX_POINTS:
+        # Too many days to draw them all: let the user zoom and thin out what's in view
+        first, last = filtered_cube["Date"].iloc[0].date(), filtered_cube["Date"].iloc[-1].date()
+        zoom = st.slider("Zoom in on", min_value=first, max_value=last, value=(first, last))
+    with profiler.stage("chart: trend"):
+        fig1, note = cached_figure(filter_key, "trend", lambda: trend_figure(filtered_cube, zoom), zoom)
+        if note:
+            st.caption(note)
+        st.plotly_chart(fig1, use_container_width=True)
+
+    # --- Visualization 2: Interactive Profit vs Loss ---
+    st.write("### Are You Making Money or Losing It?")
+    st.write("Green is profit, red is loss—click bars for details!")
+    with profiler.stage("chart: profit"):
+        fig2, _ = cached_figure(filter_key, "profit", lambda: profit_figure(filtered_cube, filtered_rows))
+        st.plotly_chart(fig2, use_container_width=True)
+
+    # --- Visualization 3: Interactive Top Products ---
+    st.write("### Your Best-Selling Products")
+    st.write("Hover to see exact sales—these are your top cash makers!")
+    with profiler.stage("chart: top products"):
+        fig3, _ = cached_figure(filter_key, "top_products", lambda: top_products_figure(top))
+        st.plotly_chart(fig3, use_container_width=True)
+
+    # --- Visualization 4: Interactive Revenue Share by Category ---
+    st.write("### Where Your Sales Come From")
+    st.write("Click slices to explore—this pie shows your sales split!")
+    with profiler.stage("chart: category"):
+        fig4, _ = cached_figure(filter_key, "category", lambda: category_figure(filtered_cube))
+        st.plotly_chart(fig4, use_container_width=True)
+
+    # --- Visualization 5: Interactive Units Sold vs Profit ---
+    st.write("### Does Selling More Mean More Profit?")
+    st.write("Hover for product details—bigger bubbles mean more sales!")
+    with st.expander("Scatter plot settings"):
+        scatter_view = st.radio("Show", ["All points", "Sample", "Density"], horizontal=True)
+        webgl_rows = st.number_input("Use WebGL above this many points", min_value=0, value=SCATTER_WEBGL_ROWS, step=1000)
+        sample_rows = st.number_input("Points to keep in Sample view", min_value=100, value=SCATTER_SAMPLE_ROWS, step=1000)
+    with profiler.stage("chart: scatter"):
+        fig5, note = cached_figure(filter_key, "scatter",
+                                   lambda: scatter_figure(filtered_rows(), scatter_view, webgl_rows, sample_rows),
+                                   scatter_view, webgl_rows, sample_rows)
+        if note:
+            st.caption(note)
+        st.plotly_chart(fig5, use_container_width=True)
+
+
+# The Q&A box is its own fragment: asking a question reruns only this function,
+# not the file load, filters and charts
+@st.fragment
+def show_chatbot_qa(filtered_cube, filter_key):
+    user_question = st.text_input("Ask me about your sales!")
+    if user_question:
+        started = time.perf_counter()
+        with profiler.stage("q&a"):
+            st.write(answer_question(user_question, filtered_cube,
+                                     daily=lambda: get_daily_index(filter_key, filtered_cube),
+                                     run=lambda query: cached_query(filter_key, filtered_cube, query)))
+        st.caption(f"Answered in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+# Collapsible table of the last timing of each page section, with a JSON-lines export
+def show_debug_panel():
+    records = profiler.records()
+    if not records:
+        return
+    with st.expander("Debug: where the time went"):
+        st.dataframe(records, column_order=["stage", "wall_ms", "cpu_ms", "peak_mb"], hide_index=True)
+        st.caption("Sections in fragments (charts, Q&A) update here on the next full rerun. "
+                   "cpu_ms is for the whole server process (worker threads included), "
+                   + ("and so is peak_mb, so other sessions running at the same time count towards both."
+                      if profiler.trace_memory else
+                      "so other sessions running at the same time count towards it. "
+                      "Set DASHBOARD_PROFILE_MEMORY=1 to measure memory (peak_mb)."))
+        st.download_button("Download as JSON lines", profiler.to_json_lines(),
+                           file_name="stage_timings.jsonl", mime="application/x-ndjson")
+        st.write("Datasets in memory, shared by all sessions:")
+        st.dataframe(get_dataset_registry().stats(), hide_index=True)
+
+
 # Streamlit UI
 st.title("📊 Your Sales Dashboard - Made Simple!")
 st.write("Upload your sales data (CSV file) to see how your business is doing!")
 
 uploaded_file = st.file_uploader("Drop Your CSV File Here", type=["csv"])
 
-if uploaded_file:
-    df = load_data(uploaded_file)
+# Files uploaded before are kept in the dataset store and can be opened again without re-uploading
+saved_key = None
+if not uploaded_file:
+    saved = {meta["key"]: meta for meta in list_datasets()}
+    if saved:
+        saved_key = st.selectbox(
+            "...or open one you uploaded before", [None, *saved],
+            format_func=lambda key: "Choose a saved dataset" if key is None else
+            f"{saved[key]['name']} ({saved[key]['rows']:,} rows, {saved[key]['first'][:10]} to {saved[key]['last'][:10]})")
+
+if uploaded_file or saved_key:
+    with profiler.stage("import: analytics"):
+        import pandas as pd
+        from sales_engine import (
+            REQUIRED_COLUMNS, TREND_DOWNSAMPLE, TREND_MAX_POINTS, DailyIndex, answer_question,
+            filter_cube, load_sales, run_query, sales_tips, summarize, summary_text, top_products,
+        )
+
+    with profiler.stage("load"):
+        data = load_data(uploaded_file) if uploaded_file else open_saved(saved_key)
+    if uploaded_file and STORE_DIR and data.cube is not None and not is_saved(data.key):
+        with profiler.stage("save"), st.spinner("Saving your file for next time..."):
+            # Datasets open in this process are kept when the store is pruned
+            save_sales(data, uploaded_file.name, keep=[d["key"] for d in get_dataset_registry().stats()])
     st.write("### Sneak Peek at Your Data:")
-    st.dataframe(df.head())
+    st.dataframe(data.head())
+    # Another session may have opened this file from the store first, and then
+    # `data` is that StoredSales (no rows in memory, nothing to report)
+    df = getattr(data, "df", None)
+    if df is not None and df.attrs.get("memory_saved"):
+        st.caption(f"Using {df.memory_usage(deep=True).sum() / 1e6:,.1f} MB in memory "
+                   f"({df.attrs['memory_saved'] / 1e6:,.1f} MB saved by compact column types).")
 
-    # Check for required columns
-    required_columns = {"Date", "Product", "Category", "Units Sold", "Price Per Unit", "Cost Per Unit", "Revenue", "Profit/Loss"}
-    if not required_columns.issubset(df.columns):
-        st.error(f"Oops! Your file is missing some key info: {required_columns}")
+    # Check for required columns (saved datasets always have them)
+    if data.cube is None:
+        st.error(f"Oops! Your file is missing some key info: {REQUIRED_COLUMNS}")
     else:
-        # Convert Date column to datetime
-        df["Date"] = pd.to_datetime(df["Date"])
-
         # --- Sidebar Filters ---
         st.sidebar.header("Filter Your Data")
-        product_filter = st.sidebar.multiselect("Choose Products", options=df["Product"].unique(), default=df["Product"].unique())
-        date_range = st.sidebar.date_input("Pick a Date Range", [df["Date"].min(), df["Date"].max()])
-        filtered_df = df[
-            (df["Product"].isin(product_filter)) &
-            (df["Date"].between(pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])))
-        ]
+        products = data.products
+        product_filter = st.sidebar.multiselect("Choose Products", options=products, default=products)
+        date_range = st.sidebar.date_input("Pick a Date Range", list(pd.to_datetime(data.bounds())))
+        with profiler.stage("filter"):
+            filtered_cube = filter_cube(data, date_range[0], date_range[1], product_filter)
+        with profiler.stage("metrics"):
+            summary = summarize(filtered_cube)
+            top = top_products(filtered_cube)
 
         # --- Key Metrics ---
         st.write("### Your Business at a Glance")
         col1, col2, col3 = st.columns(3)
-        col1.metric("Total Sales", f"${filtered_df['Revenue'].sum():,.2f}")
-        col2.metric("Total Profit/Loss", f"${filtered_df['Profit/Loss'].sum():,.2f}", 
-                    delta="Profit" if filtered_df["Profit/Loss"].sum() > 0 else "Loss", 
-                    delta_color="normal" if filtered_df["Profit/Loss"].sum() > 0 else "inverse")
-        col3.metric("Units Sold", f"{filtered_df['Units Sold'].sum():,}")
-
-        # --- Visualization 1: Interactive Sales Over Time ---
-        st.write("### How Your Sales Look Over Time")
-        st.write("Zoom in, hover for details—this shows your daily sales!")
-        sales_trend = filtered_df.groupby("Date")["Revenue"].sum().reset_index()
-        fig1 = px.line(sales_trend, x="Date", y="Revenue", title="Daily Sales Trend",
-                       labels={"Revenue": "Total Sales ($)"}, line_shape="linear", color_discrete_sequence=["green"])
-        fig1.update_layout(title_font_size=16, title_font_family="Arial", title_x=0.5)
-        st.plotly_chart(fig1, use_container_width=True)
+        col1.metric("Total Sales", f"${summary.total_revenue:,.2f}")
+        col2.metric("Total Profit/Loss", f"${summary.total_profit:,.2f}", 
+                    delta="Profit" if summary.total_profit > 0 else "Loss", 
+                    delta_color="normal" if summary.total_profit > 0 else "inverse")
+        col3.metric("Units Sold", f"{summary.total_units:,}")
 
-        # --- Visualization 2: Interactive Profit vs Loss ---
-        st.write("### Are You Making Money or Losing It?")
-        st.write("Green is profit, red is loss—click bars for details!")
-        fig2 = go.Figure()
-        fig2.add_trace(go.Bar(
-            x=filtered_df["Date"], 
-            y=filtered_df["Profit/Loss"],
-            marker_color=filtered_df["Profit/Loss"].apply(lambda x: "green" if x > 0 else "red"),
-            text=filtered_df["Profit/Loss"].apply(lambda x: f"${x:,.0f}"),
-            textposition="auto"
-        ))
-        fig2.add_hline(y=0, line_dash="dash", line_color="black")
-        fig2.update_layout(title="Profit or Loss Each Day", title_font_size=16, title_font_family="Arial", title_x=0.5,
-                           xaxis_title="Date", yaxis_title="Profit/Loss ($)")
-        st.plotly_chart(fig2, use_container_width=True)
-
-        # --- Visualization 3: Interactive Top Products ---
-        st.write("### Your Best-Selling Products")
-        st.write("Hover to see exact sales—these are your top cash makers!")
-        top_products = filtered_df.groupby("Product")["Revenue"].sum().reset_index().sort_values(by="Revenue", ascending=False).head(5)
-        fig3 = px.bar(top_products, x="Revenue", y="Product", orientation="h", title="Top 5 Products by Sales",
-                      labels={"Revenue": "Total Sales ($)"}, color="Revenue", color_continuous_scale="Blues")
-        fig3.update_layout(title_font_size=16, title_font_family="Arial", title_x=0.5, showlegend=False)
-        st.plotly_chart(fig3, use_container_width=True)
+        # Charts are cached per dataset + filters
+        filter_key = (data.key, tuple(sorted(product_filter)), tuple(str(d) for d in date_range))
 
-        # --- Visualization 4: Interactive Revenue Share by Category ---
-        st.write("### Where Your Sales Come From")
-        st.write("Click slices to explore—this pie shows your sales split!")
-        category_revenue = filtered_df.groupby("Category")["Revenue"].sum().reset_index()
-        fig4 = px.pie(category_revenue, values="Revenue", names="Category", title="Sales Share by Category",
-                      color_discrete_sequence=["#66b3ff", "#ff9999"])
-        fig4.update_traces(textinfo="percent+label", pull=[0.1, 0])  # Slightly explode one slice for emphasis
-        fig4.update_layout(title_font_size=16, title_font_family="Arial", title_x=0.5)
-        st.plotly_chart(fig4, use_container_width=True)
-
-        # --- Visualization 5: Interactive Units Sold vs Profit ---
-        st.write("### Does Selling More Mean More Profit?")
-        st.write("Hover for product details—bigger bubbles mean more sales!")
-        fig5 = px.scatter(filtered_df, x="Units Sold", y="Profit/Loss", size="Revenue", color="Product",
-                          title="Units Sold vs Profit/Loss", hover_data=["Date", "Revenue"],
-                          labels={"Profit/Loss": "Profit/Loss ($)"})
-        fig5.update_layout(title_font_size=16, title_font_family="Arial", title_x=0.5)
-        st.plotly_chart(fig5, use_container_width=True)
+        show_charts(data, filtered_cube, filter_key, top, date_range, product_filter)
 
         # --- Chatbot-Style Summary ---
         st.write("### Your Sales Chatbot Says:")
-        total_revenue = filtered_df["Revenue"].sum()
-        total_profit = filtered_df["Profit/Loss"].sum()
-        top_product = top_products.iloc[0]["Product"]
-        top_product_revenue = top_products.iloc[0]["Revenue"]
-        best_day = filtered_df.loc[filtered_df["Revenue"].idxmax()]["Date"].strftime("%Y-%m-%d")
-        worst_day = filtered_df.loc[filtered_df["Profit/Loss"].idxmin()]["Date"].strftime("%Y-%m-%d")
-
-        st.write("""
-        Hey there! Here’s a quick rundown of your sales:
-        - You’ve made **${:,.2f}** in total sales. Nice work!
-        - Your total profit (or loss) is **${:,.2f}**. {} 
-        - Your star product is **{}**, raking in **${:,.2f}**.
-        - Your best sales day was **{}**—what happened there? Let’s do more of that!
-        - Watch out for **{}**—it was your toughest day profit-wise.
-        """.format(
-            total_revenue,
-            total_profit,
-            "That’s a win!" if total_profit > 0 else "Let’s turn that around!",
-            top_product,
-            top_product_revenue,
-            best_day,
-            worst_day
-        ))
+        with profiler.stage("summary"):
+            st.write(summary_text(summary, top))
 
         # --- Enhanced Chatbot Q&A ---
-        user_question = st.text_input("Ask me about your sales!")
-        if user_question:
-            question = user_question.lower()
-            if "best product" in question:
-                st.write(f"Your best product is **{top_product}** with **${top_product_revenue:,.2f}** in sales!")
-            elif "how much" in question and "on" in question:
-                try:
-                    date = pd.to_datetime(question.split("on")[-1].strip()).strftime("%Y-%m-%d")
-                    revenue = filtered_df[filtered_df["Date"] == date]["Revenue"].sum()
-                    st.write(f"On {date}, you made **${revenue:,.2f}**.")
-                except:
-                    st.write("Sorry, I couldn’t find that date. Try something like 'How much on 2024-01-01?'")
-            else:
-                st.write("I’m not sure how to answer that yet! Try asking about your best product or sales on a specific date.")
+        show_chatbot_qa(filtered_cube, filter_key)
 
         # --- Tips Section ---
         st.write("### Quick Tips for You:")
-        if filtered_df["Profit/Loss"].sum() < 0:
-            st.write("- **Ouch, you’re losing money!** Check products with big losses (red bars) and see if costs are too high.")
-        if filtered_df.groupby("Product")["Profit/Loss"].mean().min() < 0:
-            losing_products = filtered_df.groupby("Product")["Profit/Loss"].mean()[lambda x: x < 0].index.tolist()
-            st.write(f"- **Heads up!** These products are losing money on average: {', '.join(losing_products)}. Maybe tweak pricing?")
-        if filtered_df["Units Sold"].corr(filtered_df["Profit/Loss"]) < 0.3:
-            st.write("- **Selling more isn’t always better!** Focus on high-profit items (check the scatter plot).")
+        with profiler.stage("tips"):
+            for tip in sales_tips(filtered_cube, summary):
+                st.write(tip)
+
+    show_debug_panel()
+else:
+    # Nothing open in this session any more, let go of the dataset it had
+    get_dataset_registry().release(session_id())
@@ -0,0 +1,247 @@
+"""Benchmarks for the sales dashboard on synthetic data.
+
+Generates sales CSVs with the dashboard's required columns and times every
+stage the page goes through: parsing (with the configured CSV engine or
+backend), date conversion, compaction and indexes, filtering, KPIs, each
+chart's data, figure and serialisation, the summary, the tips and the chatbot,
+plus the page's cold import time. "parse" reads the whole file at once;
+load_sales_total is the page's real load, streamed in chunks for big files.
+Results are written as JSON so runs from different versions can be compared:
+
+    python benchmark.py --rows 10000 1000000 --output before.json
+    python benchmark.py --rows 10000 1000000 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import charts
+import dataset_store
+import sales_engine as se
+
+DEFAULT_ROWS = [10_000, 1_000_000, 10_000_000, 50_000_000]
+GENERATE_CHUNK_ROWS = 1_000_000
+
+# The all-points scatter holds a few hundred bytes per point in the figure alone,
+# so it's only benchmarked up to this many filtered rows
+ALL_POINTS_MAX_ROWS = 2_000_000
+
+# What the page imports before showing the upload box, then after an upload and at the first chart
+STARTUP_IMPORTS = {
+    "landing": "import streamlit, support",
+    "analytics": "import pandas, sales_engine",
+    "charts": "import charts",
+}
+
+
+# Write a synthetic sales CSV with `rows` rows, written in chunks so 50M rows
+# don't have to fit in memory. Same seed, same file.
+def generate_sales_csv(path, rows, products=200, categories=10, days=3 * 365, seed=0):
+    rng = np.random.default_rng(seed)
+    product_names = np.array([f"Product {i:04d}" for i in range(products)])
+    category_names = np.array([f"Category {i:02d}" for i in range(categories)])
+    product_category = rng.integers(0, categories, products)
+    product_price = np.round(rng.uniform(2, 500, products), 2)
+    product_cost = np.round(product_price * rng.uniform(0.6, 1.15, products), 2)
+    dates = pd.date_range("2022-01-01", periods=days).strftime("%Y-%m-%d").to_numpy()
+    # A few products sell much more than the rest, like real catalogues
+    popularity = rng.zipf(1.3, products).astype("float64")
+    popularity /= popularity.sum()
+
+    with open(path, "w", newline="") as f:
+        for start in range(0, rows, GENERATE_CHUNK_ROWS):
+            n = min(GENERATE_CHUNK_ROWS, rows - start)
+            product = rng.choice(products, n, p=popularity)
+            units = rng.integers(1, 60, n)
+            price = product_price[product]
+            cost = product_cost[product]
+            chunk = pd.DataFrame({
+                "Date": dates[rng.integers(0, days, n)],
+                "Product": product_names[product],
+                "Category": category_names[product_category[product]],
+                "Units Sold": units,
+                "Price Per Unit": price,
+                "Cost Per Unit": cost,
+                "Revenue": np.round(units * price, 2),
+                "Profit/Loss": np.round(units * (price - cost), 2),
+            })
+            chunk.to_csv(f, index=False, header=start == 0)
+
+
+# Run fn, returning (result, seconds)
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+# Time every stage once for one CSV. Returns {stage: seconds}. The all-points
+# scatter is skipped when more than `all_points_max_rows` rows are in view.
+def run_stages(path, all_points_max_rows=ALL_POINTS_MAX_ROWS):
+    stages = {}
+
+    def stage(name, fn):
+        result, seconds = timed(fn)
+        stages[name] = seconds
+        return result
+
+    # pandas' reader is timed without its date step, which is the next stage. The
+    # other engines convert the dates as they read, leaving date_conversion nothing to do.
+    read_csv = se.csv_reader()
+    if read_csv is se.read_csv_pandas:
+        read_csv = pd.read_csv
+    with open(path, "rb") as file:
+        df = stage("parse", lambda: read_csv(file))
+    df["Date"] = stage("date_conversion", lambda: se.DateParser().parse(df["Date"]))
+    stage("compact", lambda: se.compact_sales_frame(df))
+    df = stage("sort_by_date", lambda: df.sort_values("Date", kind="stable", ignore_index=True))
+    data = stage("indexes", lambda: se.SalesData(df))
+
+    # A typical view: the middle half of the dates and half of the products
+    first, last = pd.to_datetime(se.date_bounds(df))
+    start, end = first + (last - first) / 4, last - (last - first) / 4
+    chosen = list(data.product_rows)[::2]
+    filtered_cube = stage("filter_cube", lambda: se.filter_cube(data, start, end, chosen))
+    rows = stage("filter_rows", lambda: se.filter_sales(data, start, end, chosen))
+
+    summary = stage("kpis", lambda: se.summarize(filtered_cube))
+    top = stage("top_products", lambda: se.top_products(filtered_cube))
+
+    # Per chart: its data (data_*), the Plotly figure from that data (chart_*) and the JSON sent to the browser
+    figures = [
+        ("trend", lambda: charts.trend_data(filtered_cube)[0], charts.trend_plot),
+        ("profit", lambda: charts.profit_data(filtered_cube, lambda: rows), lambda d: charts.profit_plot(*d)),
+        ("top_products", None, lambda d: charts.top_products_figure(top)[0]),
+        ("category", lambda: se.category_revenue(filtered_cube), charts.category_plot),
+        ("scatter_all", lambda: charts.scatter_data(rows, "All points", 50_000),
+         lambda d: charts.scatter_plot(d, 10_000)[0]),
+        ("scatter_sample", lambda: charts.scatter_data(rows, "Sample", 50_000),
+         lambda d: charts.scatter_plot(d, 10_000)[0]),
+        ("scatter_density", lambda: se.density_bins(rows, 60), lambda d: charts.density_plot(*d)),
+    ]
+    for name, prepare, plot in figures:
+        if name == "scatter_all" and len(rows) > all_points_max_rows:
+            continue
+        prepared = stage(f"data_{name}", prepare) if prepare is not None else None
+        fig = stage(f"chart_{name}", lambda: plot(prepared))
+        stage(f"serialize_{name}", fig.to_json)
+
+    stage("summary", lambda: se.summary_text(summary, top))
+    stage("tips", lambda: se.sales_tips(filtered_cube, summary))
+    day = pd.Timestamp(start).strftime("%Y-%m-%d")
+    stage("qa_date", lambda: se.answer_question(f"how much on {day}", filtered_cube))
+    stage("qa_query", lambda: se.answer_question("top 3 categories by profit", filtered_cube))
+    stage("load_sales_total", lambda: se.load_sales(path))
+
+    # The same view from the dataset store instead of the CSV
+    data.key = "bench"
+    with tempfile.TemporaryDirectory() as store:
+        stage("store_save", lambda: dataset_store.save_sales(data, "bench", store))
+        stored = stage("store_open", lambda: dataset_store.open_sales("bench", store))
+        stage("store_filter_cube", lambda: se.filter_cube(stored, start, end, chosen))
+        stage("store_rows", lambda: stored.rows(start, end, chosen, charts.ROW_COLUMNS))
+    return stages
+
+
+# Cold import time of each step in STARTUP_IMPORTS, each measured in a fresh
+# interpreter on top of the steps before it. Best of `repeat` runs.
+def import_times(repeat=3):
+    here = os.path.dirname(os.path.abspath(__file__))
+    times, before = {}, "import time"
+    for name, statement in STARTUP_IMPORTS.items():
+        code = f"{before}; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+        runs = [float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                     cwd=here, check=True).stdout) for _ in range(repeat)]
+        times[name] = min(runs)
+        before += f"; {statement}"
+    return times
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "csv_engine": se.CSV_ENGINE,
+        "backend": se.BACKEND,
+    }
+
+
+# Print how each stage changed against an earlier results file
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {r["rows"]: r["stages"] for r in json.load(f)["results"]}
+    for result in results:
+        before = baseline.get(result["rows"])
+        if before is None:
+            continue
+        print(f"\n{result['rows']:,} rows vs {baseline_path}")
+        for name, seconds in result["stages"].items():
+            if name in before and before[name] > 0:
+                print(f"  {name:<24}{before[name]:>10.4f}s -> {seconds:>10.4f}s  ({seconds / before[name]:.2f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="dataset sizes to run")
+    parser.add_argument("--products", type=int, default=200, help="distinct products in the synthetic data")
+    parser.add_argument("--categories", type=int, default=10, help="distinct categories in the synthetic data")
+    parser.add_argument("--days", type=int, default=3 * 365, help="distinct days in the synthetic data")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size; the fastest time of each stage is kept")
+    parser.add_argument("--data-dir", default="bench_data", help="where generated CSVs are kept between runs")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--all-points-max-rows", type=int, default=ALL_POINTS_MAX_ROWS,
+                        help="skip the all-points scatter when more rows than this are in view")
+    args = parser.parse_args(argv)
+
+    imports = import_times(args.repeat)
+    print("cold imports: " + ", ".join(f"{k}={v:.3f}s" for k, v in imports.items()), file=sys.stderr)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    for rows in args.rows:
+        path = os.path.join(args.data_dir, f"sales_{rows}_{args.products}p_{args.categories}c_{args.days}d.csv")
+        if not os.path.exists(path):
+            print(f"Generating {rows:,} rows -> {path}", file=sys.stderr)
+            generate_sales_csv(path, rows, args.products, args.categories, args.days)
+        best = {}
+        for _ in range(args.repeat):
+            for name, seconds in run_stages(path, args.all_points_max_rows).items():
+                best[name] = min(seconds, best.get(name, float("inf")))
+        results.append({
+            "rows": rows,
+            "products": args.products,
+            "categories": args.categories,
+            "days": args.days,
+            "file_mb": os.path.getsize(path) / 1e6,
+            "stages": best,
+        })
+        print(f"{rows:,} rows: " + ", ".join(f"{k}={v:.4f}s" for k, v in best.items()), file=sys.stderr)
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "imports": imports, "results": results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Plotly figures for the sales dashboard, built from sales_engine's chart data."""
+import os
+import sys
+
+import numpy as np
+
+import plotly.express as px
+import plotly.graph_objects as go
+
+from sales_engine import (
+    TREND_DOWNSAMPLE, TREND_MAX_POINTS, category_revenue, date_positions, density_bins,
+    downsample_trend, profit_bar_style, profit_by_period, sales_trend, stratified_sample,
+)
+
+# The Profit/Loss chart draws one bar per day, week or month ("period") or one bar per sale ("transaction")
+PROFIT_BARS = os.environ.get("DASHBOARD_PROFIT_BARS", "period")
+
+# Columns of the raw sales rows that any chart here uses (the scatter and per-sale bars)
+ROW_COLUMNS = ["Date", "Product", "Units Sold", "Revenue", "Profit/Loss"]
+
+
+# Each chart is a data step (the numbers, from sales_engine) and a drawing step
+# (the Plotly figure); the *_figure functions do both. They're separate so the
+# benchmark can time them apart.
+
+# Units Sold vs Profit/Loss as a 2D histogram, binned here so only the counts go to the browser
+def density_figure(df, bins=60):
+    return density_plot(*density_bins(df, bins))
+
+
+def density_plot(counts, x, y):
+    fig = go.Figure(go.Heatmap(
+        x=x,
+        y=y,
+        z=counts.T,
+        colorscale="Blues",
+        colorbar={"title": "Sales"},
+    ))
+    fig.update_layout(title="Units Sold vs Profit/Loss", xaxis_title="Units Sold", yaxis_title="Profit/Loss ($)")
+    return fig
+
+
+# Daily sales line, thinned out to the point budget within the zoom window
+def trend_figure(cube, zoom=None):
+    trend, note = trend_data(cube, zoom)
+    return trend_plot(trend), note
+
+
+def trend_data(cube, zoom=None):
+    trend = sales_trend(cube)
+    note = None
+    if zoom is not None:
+        lo, hi = date_positions(trend, zoom[0], zoom[1])
+        in_view = trend.iloc[lo:hi]
+        trend = downsample_trend(in_view, "Revenue")
+        if len(trend) < len(in_view):
+            note = (f"Showing {len(trend):,} of {len(in_view):,} days "
+                    f"({TREND_DOWNSAMPLE}, budget {TREND_MAX_POINTS:,} points). Narrow the range for full detail.")
+    return trend, note
+
+
+def trend_plot(trend):
+    fig = px.line(trend, x="Date", y="Revenue", title="Daily Sales Trend",
+                  labels={"Revenue": "Total Sales ($)"}, line_shape="linear", color_discrete_sequence=["green"])
+    fig.update_layout(title_font_size=16, title_font_family="Arial", title_x=0.5)
+    return fig
+
+
+# Green/red Profit/Loss bars per period (or per sale)
+def profit_figure(cube, filtered_rows, mode=PROFIT_BARS):
+    return profit_plot(*profit_data(cube, filtered_rows, mode)), None
+
+
+# (Profit/Loss indexed by date, what one bar is)
+def profit_data(cube, filtered_rows, mode=PROFIT_BARS):
+    if mode == "transaction":
+        return filtered_rows().set_index("Date")["Profit/Loss"], "Sale"
+    return profit_by_period(cube)
+
+
+def profit_plot(profit, period):
+    bar_colors, bar_labels = profit_bar_style(profit)
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=profit.index,
+        y=profit.to_numpy(),
+        marker_color=bar_colors,
+        text=bar_labels,
+        textposition="auto"
+    ))
+    fig.add_hline(y=0, line_dash="dash", line_color="black")
+    fig.update_layout(title=f"Profit or Loss Each {period}", title_font_size=16, title_font_family="Arial", title_x=0.5,
+                      xaxis_title="Date", yaxis_title="Profit/Loss ($)")
+    return fig
+
+
+# `top` is already the data (sales_engine.top_products)
+def top_products_figure(top):
+    fig = px.bar(top, x="Revenue", y="Product", orientation="h", title="Top 5 Products by Sales",
+                 labels={"Revenue": "Total Sales ($)"}, color="Revenue", color_continuous_scale="Blues")
+    fig.update_layout(title_font_size=16, title_font_family="Arial", title_x=0.5, showlegend=False)
+    return fig, None
+
+
+def category_figure(cube):
+    return category_plot(category_revenue(cube)), None
+
+
+def category_plot(revenue):
+    fig = px.pie(revenue, values="Revenue", names="Category", title="Sales Share by Category",
+                 color_discrete_sequence=["#66b3ff", "#ff9999"])
+    fig.update_traces(textinfo="percent+label", pull=[0.1, 0])  # Slightly explode one slice for emphasis
+    fig.update_layout(title_font_size=16, title_font_family="Arial", title_x=0.5)
+    return fig
+
+
+# Units Sold vs Profit/Loss as points (all or a sample, WebGL when big) or as a density map
+def scatter_figure(rows, view, webgl_rows, sample_rows):
+    if view == "Density":
+        fig, note = density_figure(rows), None
+    else:
+        points = scatter_data(rows, view, sample_rows)
+        fig, render_mode = scatter_plot(points, webgl_rows)
+        note = f"{len(points):,} of {len(rows):,} sales shown, drawn with {render_mode.upper()}."
+    fig.update_layout(title_font_size=16, title_font_family="Arial", title_x=0.5)
+    return fig, note
+
+
+# The rows to draw as points: all of them or a sample
+def scatter_data(rows, view, sample_rows):
+    return stratified_sample(rows, sample_rows) if view == "Sample" else rows
+
+
+# (figure, render mode)
+def scatter_plot(points, webgl_rows):
+    render_mode = "webgl" if len(points) > webgl_rows else "svg"
+    fig = px.scatter(points, x="Units Sold", y="Profit/Loss", size="Revenue", color="Product",
+                     title="Units Sold vs Profit/Loss", hover_data=["Date", "Revenue"],
+                     labels={"Profit/Loss": "Profit/Loss ($)"}, render_mode=render_mode)
+    return fig, render_mode
+
+
+# Roughly how much memory a figure holds, for the figure cache's budget. Nearly
+# all of it is in the traces' arrays: numbers in numpy arrays, and hover data in
+# object arrays of Python objects, which are sized from a sample of them.
+def figure_nbytes(fig) -> int:
+    return sum(_nbytes(getattr(trace, "_props", {})) for trace in fig.data)
+
+
+def _nbytes(value) -> int:
+    if isinstance(value, np.ndarray):
+        size = value.nbytes
+        if value.dtype == object and value.size:
+            sample = value.ravel()[:: max(value.size // 100, 1)]
+            size += value.size * sum(sys.getsizeof(v) for v in sample) // len(sample)
+        return size
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_nbytes(v) for v in value)
+    return sys.getsizeof(value)
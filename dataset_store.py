@@ -0,0 +1,304 @@
+"""Saved sales datasets on local disk.
+
+An upload is parsed once and written as compressed Parquet: the rows
+partitioned by month, plus the pre-aggregated cube and a small meta.json.
+Later sessions pick it from list_datasets() and open it with open_sales(),
+which reads the cube (small) straight away and the rows only when a chart
+needs them, and then only the months and columns asked for.
+
+With STORE_MMAP on, the rows are also kept as one uncompressed Arrow file
+sorted by date. That one is memory-mapped rather than read: a date range is a
+zero-copy slice of the mapping, and every session (and every process) looking
+at the dataset shares the same pages through the OS page cache.
+
+    datasets/<content hash>/meta.json
+                           /cube.parquet
+                           /rows/Month=2024-01/part-0.parquet ...
+                           /rows.arrow
+
+The store doesn't grow forever: each save prunes datasets nobody has opened for
+STORE_MAX_AGE_DAYS, then the least recently opened ones past STORE_MAX_MB.
+
+pandas and pyarrow are imported inside the functions that use them, so listing
+what's saved stays cheap on the upload page.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import TYPE_CHECKING, Iterable, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Where saved datasets live; empty turns saving and the dataset list off
+STORE_DIR = os.environ.get("DASHBOARD_STORE_DIR", "datasets")
+
+# Parquet compression for saved datasets ("zstd", "snappy", "none"...)
+STORE_COMPRESSION = os.environ.get("DASHBOARD_STORE_COMPRESSION", "zstd")
+
+# Also write (and read through) the memory-mapped Arrow copy of the rows.
+# It's uncompressed, so it takes more disk than the Parquet partitions.
+STORE_MMAP = os.environ.get("DASHBOARD_STORE_MMAP", "1") == "1"
+
+# After each save, datasets not opened for STORE_MAX_AGE_DAYS are deleted, and then
+# the least recently opened ones until the store fits in STORE_MAX_MB (0 turns either off)
+STORE_MAX_MB = int(os.environ.get("DASHBOARD_STORE_MAX_MB", "5120"))
+STORE_MAX_AGE_DAYS = float(os.environ.get("DASHBOARD_STORE_MAX_AGE_DAYS", "30"))
+
+META_FILE = "meta.json"
+CUBE_FILE = "cube.parquet"
+ROWS_DIR = "rows"
+ARROW_FILE = "rows.arrow"
+PARTITION_COLUMN = "Month"
+
+
+def dataset_path(key: str, store_dir: str = STORE_DIR) -> str:
+    return os.path.join(store_dir, key)
+
+
+def is_saved(key: str, store_dir: str = STORE_DIR) -> bool:
+    return os.path.exists(os.path.join(dataset_path(key, store_dir), META_FILE))
+
+
+# Everything saved, newest first, as the dicts from each meta.json
+def list_datasets(store_dir: str = STORE_DIR) -> list:
+    if not store_dir or not os.path.isdir(store_dir):
+        return []
+    datasets = []
+    for entry in os.scandir(store_dir):
+        meta_path = os.path.join(entry.path, META_FILE)
+        if entry.is_dir() and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                datasets.append(json.load(f))
+    return sorted(datasets, key=lambda meta: meta["saved_at"], reverse=True)
+
+
+# Bytes on disk for one saved dataset
+def dataset_size(key: str, store_dir: str = STORE_DIR) -> int:
+    size = 0
+    for folder, _, files in os.walk(dataset_path(key, store_dir)):
+        size += sum(os.path.getsize(os.path.join(folder, f)) for f in files)
+    return size
+
+
+# When a dataset was last opened (or saved): its meta.json's modification time
+def last_used(key: str, store_dir: str = STORE_DIR) -> float:
+    return os.path.getmtime(os.path.join(dataset_path(key, store_dir), META_FILE))
+
+
+# meta.json goes first, so the dataset stops being listed before its files go
+def delete_dataset(key: str, store_dir: str = STORE_DIR) -> None:
+    path = dataset_path(key, store_dir)
+    try:
+        os.remove(os.path.join(path, META_FILE))
+    except FileNotFoundError:
+        return
+    shutil.rmtree(path, ignore_errors=True)
+
+
+# Delete datasets past STORE_MAX_AGE_DAYS, then the least recently opened ones
+# until the rest fit in STORE_MAX_MB. Datasets in `keep` (open right now) stay.
+# Returns the keys deleted.
+def prune_store(store_dir: str = STORE_DIR, keep: Iterable = ()) -> list:
+    keep = set(keep)
+    now = time.time()
+    datasets = []
+    for meta in list_datasets(store_dir):
+        try:
+            datasets.append((last_used(meta["key"], store_dir), meta["key"]))
+        except FileNotFoundError:
+            continue  # deleted meanwhile
+    deleted, total = [], 0
+    for used, key in sorted(datasets, reverse=True):
+        size = dataset_size(key, store_dir)
+        too_old = STORE_MAX_AGE_DAYS and now - used > STORE_MAX_AGE_DAYS * 86400
+        too_big = STORE_MAX_MB and total + size > STORE_MAX_MB * 1024 * 1024
+        if key not in keep and (too_old or too_big):
+            delete_dataset(key, store_dir)
+            deleted.append(key)
+        else:
+            total += size
+    return deleted
+
+
+# Write a loaded SalesData into the store under its content hash (a no-op when
+# it's already there), then prune the store (keeping this dataset and `keep`).
+# Everything goes to a temporary folder first and is moved into place at the
+# end, so readers never see half a dataset.
+def save_sales(data, name: str, store_dir: str = STORE_DIR, keep: Iterable = ()) -> str:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    path = dataset_path(data.key, store_dir)
+    if is_saved(data.key, store_dir):
+        return path
+    os.makedirs(store_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=store_dir, prefix=".saving-")
+    try:
+        rows = pa.Table.from_pandas(data.df, preserve_index=False)
+        rows = rows.append_column(PARTITION_COLUMN, pc.strftime(rows["Date"], "%Y-%m"))
+        ds.write_dataset(
+            rows, os.path.join(tmp, ROWS_DIR), format="parquet",
+            partitioning=ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive"),
+            file_options=ds.ParquetFileFormat().make_write_options(compression=STORE_COMPRESSION),
+            basename_template="part-{i}.parquet", preserve_order=True,
+        )
+        if STORE_MMAP:
+            # One record batch, so the mapped columns are single contiguous buffers
+            columns = rows.drop_columns([PARTITION_COLUMN])
+            with pa.OSFile(os.path.join(tmp, ARROW_FILE), "wb") as sink, \
+                    pa.ipc.new_file(sink, columns.schema) as writer:
+                writer.write_table(columns, max_chunksize=max(len(columns), 1))
+        pq.write_table(pa.Table.from_pandas(data.cube, preserve_index=False),
+                       os.path.join(tmp, CUBE_FILE), compression=STORE_COMPRESSION)
+        first, last = data.bounds()
+        meta = {
+            "key": data.key,
+            "name": name,
+            "rows": len(data.df),
+            "first": str(first),
+            "last": str(last),
+            "products": data.products,
+            "columns": list(data.df.columns),
+            "saved_at": time.time(),
+        }
+        with open(os.path.join(tmp, META_FILE), "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+    except OSError:
+        # Another session saved the same file first
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not is_saved(data.key, store_dir):
+            raise
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    prune_store(store_dir, keep={data.key, *keep})
+    return path
+
+
+# A saved dataset, opened. The cube is read up front; rows are read on demand.
+class StoredSales:
+    def __init__(self, path: str):
+        import pandas as pd
+
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        # Opening counts as a use, for prune_store
+        try:
+            os.utime(os.path.join(path, META_FILE))
+        except OSError:
+            pass
+        self.key = self.meta["key"]
+        self.name = self.meta["name"]
+        self.products = self.meta["products"]
+        self.cube = pd.read_parquet(os.path.join(path, CUBE_FILE))
+        self._mapped = None
+
+    def bounds(self) -> tuple:
+        import numpy as np
+
+        return np.datetime64(self.meta["first"]), np.datetime64(self.meta["last"])
+
+    def _dataset(self):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        return ds.dataset(os.path.join(self.path, ROWS_DIR), format="parquet",
+                          partitioning=ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive"))
+
+    # The Arrow copy of the rows, memory-mapped on first use (None if there isn't one)
+    def _mapped_rows(self):
+        import pyarrow as pa
+
+        path = os.path.join(self.path, ARROW_FILE)
+        if self._mapped is None and STORE_MMAP and os.path.exists(path):
+            self._mapped = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        return self._mapped
+
+    # Rows for a date range and products, only reading `columns`
+    def rows(self, start=None, end=None, products: Optional[Iterable] = None,
+             columns: Optional[list] = None) -> pd.DataFrame:
+        if self._mapped_rows() is not None:
+            return self._mapped_slice(start, end, products, columns)
+        return self._parquet_rows(start, end, products, columns)
+
+    # From the memory-mapped file. Rows are sorted by date (missing dates last),
+    # so the range is two binary searches over the mapped Date buffer and a
+    # zero-copy slice; only the product filter makes a copy, of the matching rows.
+    def _mapped_slice(self, start, end, products, columns):
+        import numpy as np
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        table = self._mapped_rows()
+        dates = table.column("Date").chunk(0) if table.num_rows else None
+        lo, hi = 0, table.num_rows
+        if dates is not None and (start is not None or end is not None):
+            unit = dates.type.unit
+            valid = len(dates) - dates.null_count
+            stamps = np.frombuffer(dates.buffers()[1], dtype=np.int64, count=valid, offset=dates.offset * 8)
+            hi = valid
+            if start is not None:
+                lo = stamps.searchsorted(np.datetime64(pd.Timestamp(start), unit).astype(np.int64), side="left")
+            if end is not None:
+                hi = stamps.searchsorted(np.datetime64(pd.Timestamp(end), unit).astype(np.int64), side="right")
+        table = table.slice(lo, max(hi - lo, 0))
+        if products is not None and not set(products).issuperset(self.products):
+            table = table.filter(pc.is_in(table.column("Product"), value_set=pa.array(list(products), pa.string())))
+        return self._to_pandas(table.select(columns or self.meta["columns"]))
+
+    # From the Parquet partitions. The month partitions outside the range are
+    # skipped without being opened.
+    def _parquet_rows(self, start, end, products, columns):
+        import pandas as pd
+        import pyarrow.dataset as ds
+
+        month, date = ds.field(PARTITION_COLUMN), ds.field("Date")
+        conditions = []
+        if start is not None:
+            start = pd.Timestamp(start)
+            conditions += [month >= start.strftime("%Y-%m"), date >= start]
+        if end is not None:
+            end = pd.Timestamp(end)
+            conditions += [month <= end.strftime("%Y-%m"), date <= end]
+        if products is not None and not set(products).issuperset(self.products):
+            conditions.append(ds.field("Product").isin(list(products)))
+        where = None
+        for condition in conditions:
+            where = condition if where is None else where & condition
+        table = self._dataset().to_table(columns=columns or self.meta["columns"], filter=where)
+        return self._to_pandas(table)
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        if self._mapped_rows() is not None:
+            return self._to_pandas(self._mapped_rows().slice(0, n))
+        return self._to_pandas(self._dataset().head(n, columns=self.meta["columns"]))
+
+    # Each Parquet file has its own dictionary, so put categories back in sorted order.
+    # split_blocks lets numeric columns without gaps stay views of the Arrow buffers.
+    def _to_pandas(self, table) -> pd.DataFrame:
+        import pandas as pd
+
+        df = table.to_pandas(split_blocks=True)
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+        return df
+
+    # Only the cube counts: the mapped rows live in the page cache, not in this process
+    @property
+    def nbytes(self) -> int:
+        return int(self.cube.memory_usage(deep=True).sum())
+
+
+def open_sales(key: str, store_dir: str = STORE_DIR) -> StoredSales:
+    return StoredSales(dataset_path(key, store_dir))
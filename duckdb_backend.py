@@ -0,0 +1,150 @@
+"""DuckDB versions of the sales_engine groupbys.
+
+Picked with DASHBOARD_BACKEND=duckdb (needs the duckdb package). The frames are
+scanned in place and aggregated by DuckDB's multithreaded engine; saved
+datasets are filtered inside the Parquet scan, so only the row groups in the
+date range are read. Every function returns what its sales_engine namesake
+returns, down to dtypes and row order (filter_cube's rows get a fresh index),
+so the rest of the page can't tell which backend ran. Float sums use fsum (compensated, like
+pandas' groupby sum); summing in a different order can still move the last
+bit of a float, far below a cent.
+"""
+from __future__ import annotations
+
+import os
+import threading
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from sales_engine import match_dtypes, sum_dtype
+
+_database = None
+_database_lock = threading.Lock()
+
+
+# A fresh cursor on one in-memory database shared by the whole process. A
+# connection can't be used from two threads at once, and Streamlit runs every
+# rerun (and fragment rerun) on a new thread, so one connection per thread would
+# mean a new one on every rerun; a cursor costs a fraction of that.
+def connection() -> duckdb.DuckDBPyConnection:
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = duckdb.connect()
+    return _database.cursor()
+
+
+def _sum(column: str, dtype) -> str:
+    if pd.api.types.is_integer_dtype(dtype):
+        return f'COALESCE(SUM("{column}"), 0)::BIGINT'
+    return f'COALESCE(fsum("{column}"), 0)'
+
+
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    units_type, profit_type = df["Units Sold"].dtype, df["Profit/Loss"].dtype
+    paired = '"Units Sold" IS NOT NULL AND "Profit/Loss" IS NOT NULL'
+    x, y = '"Units Sold"::DOUBLE', '"Profit/Loss"::DOUBLE'
+    cube = connection().execute(f"""
+        SELECT "Date", "Product", "Category",
+            {_sum("Revenue", df["Revenue"].dtype)} AS "Revenue",
+            {_sum("Profit/Loss", profit_type)} AS "Profit/Loss",
+            {_sum("Units Sold", units_type)} AS "Units Sold",
+            COUNT(*) AS "Rows",
+            COUNT("Profit/Loss") AS "Profit Rows",
+            MAX("Revenue") AS "Max Revenue",
+            MIN("Profit/Loss") AS "Min Profit",
+            COUNT(*) FILTER (WHERE {paired}) AS "Paired Rows",
+            COALESCE(fsum({x}) FILTER (WHERE {paired}), 0) AS "Sum X",
+            COALESCE(fsum({y}) FILTER (WHERE {paired}), 0) AS "Sum Y",
+            COALESCE(fsum({x} * {x}) FILTER (WHERE {paired}), 0) AS "Sum XX",
+            COALESCE(fsum({y} * {y}) FILTER (WHERE {paired}), 0) AS "Sum YY",
+            COALESCE(fsum({x} * {y}) FILTER (WHERE {paired}), 0) AS "Sum XY"
+        FROM df
+        GROUP BY ALL
+        ORDER BY "Date" NULLS LAST, "Product" NULLS LAST, "Category" NULLS LAST
+    """).df()
+    like = {
+        "Date": df["Date"].dtype,
+        "Product": df["Product"].dtype,
+        "Category": df["Category"].dtype,
+        "Revenue": sum_dtype(df["Revenue"]),
+        "Profit/Loss": sum_dtype(df["Profit/Loss"]),
+        "Units Sold": sum_dtype(df["Units Sold"]),
+        "Max Revenue": df["Revenue"].dtype,
+        "Min Profit": profit_type,
+    }
+    return match_dtypes(cube, like)
+
+
+# The part of the cube matching the date range and products. Saved datasets are
+# read straight from their cube.parquet with the filter pushed into the scan.
+def filter_cube(data, start, end, products) -> pd.DataFrame:
+    path = getattr(data, "path", None)
+    source = "data_cube" if path is None else "read_parquet($path)"
+    params = {"start": pd.Timestamp(start), "end": pd.Timestamp(end)}
+    where = '"Date" BETWEEN $start AND $end'
+    if not set(products).issuperset(data.products):
+        where += ' AND list_contains($products, "Product"::VARCHAR)'
+        params["products"] = [str(p) for p in products]
+    if path is not None:
+        params["path"] = os.path.join(path, "cube.parquet")
+    con = connection()
+    if path is None:
+        con.register("data_cube", data.cube)
+    try:
+        cube = con.execute(f"""
+            SELECT * FROM {source} WHERE {where}
+            ORDER BY "Date", "Product" NULLS LAST, "Category" NULLS LAST
+        """, params).df()
+    finally:
+        if path is None:
+            con.unregister("data_cube")
+    return match_dtypes(cube, data.cube.dtypes.to_dict())
+
+
+def sales_trend(cube: pd.DataFrame) -> pd.DataFrame:
+    trend = connection().execute("""
+        SELECT "Date", fsum("Revenue") AS "Revenue" FROM cube
+        WHERE "Date" IS NOT NULL GROUP BY "Date" ORDER BY "Date"
+    """).df()
+    return match_dtypes(trend, {"Date": cube["Date"].dtype, "Revenue": sum_dtype(cube["Revenue"])})
+
+
+# Per-product totals in product order (the index pandas' reset_index gives), then the n best
+def top_products(cube: pd.DataFrame, n: int = 5) -> pd.DataFrame:
+    totals = connection().execute("""
+        SELECT "Product", fsum("Revenue") AS "Revenue" FROM cube
+        WHERE "Product" IS NOT NULL GROUP BY "Product" ORDER BY "Product"
+    """).df()
+    totals = match_dtypes(totals, {"Product": cube["Product"].dtype, "Revenue": sum_dtype(cube["Revenue"])})
+    order = np.argsort(-totals["Revenue"].to_numpy(), kind="stable")[:n]
+    return totals.iloc[order]
+
+
+def category_revenue(cube: pd.DataFrame) -> pd.DataFrame:
+    revenue = connection().execute("""
+        SELECT "Category", fsum("Revenue") AS "Revenue" FROM cube
+        WHERE "Category" IS NOT NULL GROUP BY "Category" ORDER BY "Category"
+    """).df()
+    return match_dtypes(revenue, {"Category": cube["Category"].dtype, "Revenue": sum_dtype(cube["Revenue"])})
+
+
+def daily_profit(cube: pd.DataFrame) -> pd.Series:
+    daily = connection().execute("""
+        SELECT "Date", fsum("Profit/Loss") AS "Profit/Loss" FROM cube
+        WHERE "Date" IS NOT NULL GROUP BY "Date" ORDER BY "Date"
+    """).df()
+    daily = match_dtypes(daily, {"Date": cube["Date"].dtype, "Profit/Loss": sum_dtype(cube["Profit/Loss"])})
+    return daily.set_index("Date")["Profit/Loss"]
+
+
+def product_profit_mean(cube: pd.DataFrame) -> pd.Series:
+    per_product = connection().execute("""
+        SELECT "Product", fsum("Profit/Loss") / NULLIF(SUM("Profit Rows"), 0) AS "Mean" FROM cube
+        WHERE "Product" IS NOT NULL GROUP BY "Product" ORDER BY "Product"
+    """).df()
+    index = pd.CategoricalIndex(per_product["Product"].astype(object), categories=cube["Product"].cat.categories,
+                                name="Product")
+    return pd.Series(per_product["Mean"].to_numpy(dtype="float64", na_value=np.nan), index=index)
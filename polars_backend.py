@@ -0,0 +1,212 @@
+"""Polars versions of the CSV load and the sales_engine groupbys.
+
+Picked with DASHBOARD_BACKEND=polars (needs the polars package). The CSV is
+read and its dates converted by Polars' multithreaded reader, in batches for
+files big enough to be streamed. filter_cube builds one lazy plan: the
+product/date filter plus every aggregation the page draws from it (daily
+revenue and profit, revenue per product and per category, mean profit per
+product). It runs them all with a single collect_all, so the filter is
+computed once and the aggregations run in parallel. The results are kept
+alongside the filtered cube and handed out when the charts, the summary and
+the tips ask for them. Return values match the pandas path the same way
+duckdb_backend's do.
+"""
+from __future__ import annotations
+
+import weakref
+from typing import IO, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from sales_engine import (
+    DATE_SAMPLE_SIZE, STREAM_CHUNK_ROWS, DateParser, match_dtypes, missing_columns, read_csv_pandas, sum_dtype,
+)
+
+# Column types are inferred from this many rows. Inferring from the whole file
+# (infer_schema_length=None) reads it twice; a later value that doesn't fit the
+# inferred type raises, and then pandas reads the file instead.
+INFER_SCHEMA_ROWS = 10_000
+
+# Aggregates already worked out for a cube, by id(cube); dropped with the cube
+_aggregates = {}
+
+
+def read_csv(file: IO[bytes]) -> pd.DataFrame:
+    try:
+        frame = pl.read_csv(file, infer_schema_length=INFER_SCHEMA_ROWS, schema_overrides={"Date": pl.String})
+    except pl.exceptions.PolarsError:
+        # Something Polars won't read the way pandas does (ragged rows, odd quoting...)
+        file.seek(0)
+        return read_csv_pandas(file)
+    if "Date" in frame.columns:
+        frame = frame.with_columns(_parse_dates(frame["Date"]))
+    df = frame.to_pandas()
+    if not missing_columns(df) and not pd.api.types.is_datetime64_any_dtype(df["Date"]):
+        df["Date"] = DateParser().parse(df["Date"])
+    return df
+
+
+# Big files (over STREAM_THRESHOLD_MB), as a lazy scan collected in batches of
+# STREAM_CHUNK_ROWS rows, dates included. The date format is detected from the
+# first rows; without a single format the dates stay strings for DateParser.
+# Errors come out as ValueError, which makes parse_csv_chunked start over with pandas.
+def read_csv_chunks(file: IO[bytes]) -> Iterable[pd.DataFrame]:
+    try:
+        head = pl.read_csv(file, n_rows=STREAM_CHUNK_ROWS, infer_schema_length=0)
+        file.seek(0)
+        plan = pl.scan_csv(file, infer_schema_length=INFER_SCHEMA_ROWS, schema_overrides={"Date": pl.String})
+        fmt = _date_format(head["Date"]) if "Date" in head.columns else None
+        if fmt is not None:
+            plan = plan.with_columns(pl.col("Date").str.to_datetime(fmt, time_unit="ns", strict=True))
+        for batch in plan.collect_batches(chunk_size=STREAM_CHUNK_ROWS):
+            yield batch.to_pandas()
+    except pl.exceptions.PolarsError as e:
+        raise ValueError(str(e)) from e
+
+
+# The format DateParser detects on a sample of the distinct values (or None)
+def _date_format(dates: pl.Series) -> Optional[str]:
+    sample = dates.drop_nulls().unique(maintain_order=True).head(DATE_SAMPLE_SIZE).to_pandas()
+    return DateParser().detect_format(sample)
+
+
+# Parse with the format DateParser detects on a sample of the distinct values.
+# Leaves the strings alone when there's no single format, for DateParser to guess.
+def _parse_dates(dates: pl.Series) -> pl.Series:
+    fmt = _date_format(dates)
+    if fmt is None:
+        return dates
+    try:
+        return dates.str.to_datetime(fmt, time_unit="ns", strict=True)
+    except pl.exceptions.PolarsError:
+        return dates
+
+
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    paired = pl.col("Units Sold").is_not_null() & pl.col("Profit/Loss").is_not_null()
+    x, y = pl.col("Units Sold").cast(pl.Float64), pl.col("Profit/Loss").cast(pl.Float64)
+    cube = (
+        pl.from_pandas(df[["Date", "Product", "Category", "Revenue", "Profit/Loss", "Units Sold"]]).lazy()
+        .group_by("Date", "Product", "Category")
+        .agg(
+            pl.col("Revenue").sum(),
+            pl.col("Profit/Loss").sum(),
+            pl.col("Units Sold").sum(),
+            pl.len().alias("Rows"),
+            pl.col("Profit/Loss").count().alias("Profit Rows"),
+            pl.col("Revenue").max().alias("Max Revenue"),
+            pl.col("Profit/Loss").min().alias("Min Profit"),
+            paired.sum().alias("Paired Rows"),
+            x.filter(paired).sum().alias("Sum X"),
+            y.filter(paired).sum().alias("Sum Y"),
+            (x * x).filter(paired).sum().alias("Sum XX"),
+            (y * y).filter(paired).sum().alias("Sum YY"),
+            (x * y).filter(paired).sum().alias("Sum XY"),
+        )
+        .sort(pl.col("Date"), pl.col("Product").cast(pl.String), pl.col("Category").cast(pl.String), nulls_last=True)
+        .collect()
+        .to_pandas()
+    )
+    like = {
+        "Date": df["Date"].dtype,
+        "Product": df["Product"].dtype,
+        "Category": df["Category"].dtype,
+        "Revenue": sum_dtype(df["Revenue"]),
+        "Profit/Loss": sum_dtype(df["Profit/Loss"]),
+        "Units Sold": sum_dtype(df["Units Sold"]),
+        "Rows": np.dtype("int64"),
+        "Profit Rows": np.dtype("int64"),
+        "Max Revenue": df["Revenue"].dtype,
+        "Min Profit": df["Profit/Loss"].dtype,
+        "Paired Rows": np.dtype("int64"),
+    }
+    return match_dtypes(cube, like)
+
+
+# The lazy plans for everything the page aggregates from a (filtered) cube
+def _aggregate_plans(cube: pl.LazyFrame) -> dict:
+    def by(key, *values):
+        return (cube.filter(pl.col(key).is_not_null()).group_by(key).agg(*values)
+                .sort(pl.col(key).cast(pl.String) if key != "Date" else pl.col(key)))
+
+    return {
+        "daily": by("Date", pl.col("Revenue").sum(), pl.col("Profit/Loss").sum()),
+        "product": by("Product", pl.col("Revenue").sum(), pl.col("Profit/Loss").sum(), pl.col("Profit Rows").sum()),
+        "category": by("Category", pl.col("Revenue").sum()),
+    }
+
+
+# Run the plans and remember the results for `cube` until it's garbage collected
+def _remember(cube: pd.DataFrame, results: dict) -> dict:
+    key = id(cube)
+    _aggregates[key] = results
+    weakref.finalize(cube, _aggregates.pop, key, None)
+    return results
+
+
+def _aggregates_for(cube: pd.DataFrame) -> dict:
+    results = _aggregates.get(id(cube))
+    if results is None:
+        plans = _aggregate_plans(pl.from_pandas(cube).lazy())
+        results = _remember(cube, dict(zip(plans, pl.collect_all(list(plans.values())))))
+    return results
+
+
+# The part of the cube matching the date range and products, computed in the
+# same collect_all as all of its aggregates
+def filter_cube(data, start, end, products) -> pd.DataFrame:
+    view = _polars_cube(data).lazy().filter(
+        pl.col("Date").is_between(pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime()))
+    if not set(products).issuperset(data.products):
+        view = view.filter(pl.col("Product").cast(pl.String).is_in([str(p) for p in products]))
+    plans = _aggregate_plans(view)
+    cube, *results = pl.collect_all([view, *plans.values()])
+    cube = match_dtypes(cube.to_pandas(), data.cube.dtypes.to_dict())
+    _remember(cube, dict(zip(plans, results)))
+    return cube
+
+
+# data.cube as a Polars frame, converted once per dataset
+_cubes = weakref.WeakKeyDictionary()
+
+
+def _polars_cube(data) -> pl.DataFrame:
+    frame = _cubes.get(data)
+    if frame is None:
+        frame = _cubes[data] = pl.from_pandas(data.cube)
+    return frame
+
+
+def sales_trend(cube: pd.DataFrame) -> pd.DataFrame:
+    daily = _aggregates_for(cube)["daily"].select("Date", "Revenue").to_pandas()
+    return match_dtypes(daily, {"Date": cube["Date"].dtype, "Revenue": sum_dtype(cube["Revenue"])})
+
+
+def daily_profit(cube: pd.DataFrame) -> pd.Series:
+    daily = _aggregates_for(cube)["daily"].select("Date", "Profit/Loss").to_pandas()
+    daily = match_dtypes(daily, {"Date": cube["Date"].dtype, "Profit/Loss": sum_dtype(cube["Profit/Loss"])})
+    return daily.set_index("Date")["Profit/Loss"]
+
+
+# Per-product totals in product order (the index pandas' reset_index gives), then the n best
+def top_products(cube: pd.DataFrame, n: int = 5) -> pd.DataFrame:
+    totals = _aggregates_for(cube)["product"].select("Product", "Revenue").to_pandas()
+    totals = match_dtypes(totals, {"Product": cube["Product"].dtype, "Revenue": sum_dtype(cube["Revenue"])})
+    order = np.argsort(-totals["Revenue"].to_numpy(), kind="stable")[:n]
+    return totals.iloc[order]
+
+
+def category_revenue(cube: pd.DataFrame) -> pd.DataFrame:
+    revenue = _aggregates_for(cube)["category"].to_pandas()
+    return match_dtypes(revenue, {"Category": cube["Category"].dtype, "Revenue": sum_dtype(cube["Revenue"])})
+
+
+def product_profit_mean(cube: pd.DataFrame) -> pd.Series:
+    per_product = _aggregates_for(cube)["product"]
+    index = pd.CategoricalIndex(per_product["Product"].cast(pl.String).to_list(),
+                                categories=cube["Product"].cat.categories, name="Product")
+    rows = per_product["Profit Rows"].to_numpy().astype("float64")
+    rows[rows == 0] = np.nan
+    return pd.Series(per_product["Profit/Loss"].to_numpy().astype("float64") / rows, index=index)
@@ -0,0 +1,895 @@
+"""Sales analytics without the UI.
+
+Loading, validation, filtering, KPIs, chart data, tips and the chatbot's
+answers for the sales dashboard. Nothing in here touches Streamlit, so it can
+be imported from batch jobs, notebooks and benchmarks; app.py is the page
+on top of it.
+"""
+from __future__ import annotations
+
+import importlib
+import os
+import re
+from dataclasses import dataclass
+from typing import IO, Callable, Iterable, Optional, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype, union_categoricals
+
+# Columns every sales file must have
+REQUIRED_COLUMNS = {"Date", "Product", "Category", "Units Sold", "Price Per Unit", "Cost Per Unit", "Revenue", "Profit/Loss"}
+
+# Files bigger than this (in MB) are read in chunks of about STREAM_CHUNK_ROWS rows
+# (with the CSV_ENGINE below, so a progress bar can show how far along it is)
+STREAM_THRESHOLD_MB = int(os.environ.get("DASHBOARD_STREAM_THRESHOLD_MB", "100"))
+STREAM_CHUNK_ROWS = int(os.environ.get("DASHBOARD_STREAM_CHUNK_ROWS", "500000"))
+
+# Date formats we try (in order) before falling back to pandas' per-value guessing
+DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%Y/%m/%d", "%d-%m-%Y", "%d.%m.%Y",
+                "%Y-%m-%d %H:%M:%S", "%m/%d/%Y %H:%M", "%Y%m%d"]
+DATE_SAMPLE_SIZE = 1000
+
+# Which parser reads the CSV: "pandas" (default C parser) or "pyarrow" (multithreaded)
+CSV_ENGINE = os.environ.get("DASHBOARD_CSV_ENGINE", "pandas")
+
+# Where the groupbys run: "pandas" (default), "duckdb" (multithreaded SQL, needs
+# the duckdb package) or "polars" (lazy plans run in parallel, needs polars, and
+# also reads the CSV). All give the same results; see backend().
+BACKEND = os.environ.get("DASHBOARD_BACKEND", "pandas")
+BACKEND_MODULES = {"duckdb": "duckdb_backend", "polars": "polars_backend"}
+
+# Text columns that repeat a lot and are cheaper to keep as categories
+CATEGORY_COLUMNS = ["Product", "Category"]
+
+# Per-unit prices are only displayed, never summed, so float32 is enough for them.
+# Revenue and Profit/Loss stay float64: they get added up everywhere and float32
+# totals drift by whole dollars on a few hundred thousand rows.
+UNIT_PRICE_COLUMNS = ["Price Per Unit", "Cost Per Unit"]
+
+# The sales trend line is thinned out to at most this many points before it goes
+# to the browser. TREND_DOWNSAMPLE is "lttb", "minmax" or "off".
+TREND_MAX_POINTS = int(os.environ.get("DASHBOARD_TREND_POINTS", "2000"))
+TREND_DOWNSAMPLE = os.environ.get("DASHBOARD_TREND_DOWNSAMPLE", "lttb")
+
+# The Profit/Loss bars are drawn per day, week or month, whichever is the finest that fits in this many bars
+PROFIT_MAX_BARS = int(os.environ.get("DASHBOARD_PROFIT_MAX_BARS", "366"))
+
+# A CSV path or an open binary file (Streamlit's UploadedFile is one)
+Source = Union[str, os.PathLike, IO[bytes]]
+# Called while streaming a big file with (fraction done, rows read so far)
+Progress = Callable[[float, int], None]
+
+
+# The module that takes over build_cube, filter_cube and the chart groupbys
+# for the configured BACKEND, or None when pandas does them here. A backend
+# that also defines read_csv (and read_csv_chunks, for files big enough to
+# stream) takes over reading the file.
+def backend():
+    name = BACKEND_MODULES.get(BACKEND)
+    return importlib.import_module(name) if name else None
+
+
+# Give a backend's result the dtypes pandas would have produced (`like` maps
+# column to dtype): the same categories, datetime unit and number types
+def match_dtypes(result: pd.DataFrame, like: dict) -> pd.DataFrame:
+    for col, dtype in like.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            result[col] = pd.Categorical(result[col].astype(object), categories=dtype.categories)
+        elif result[col].dtype != dtype:
+            result[col] = result[col].astype(dtype)
+    return result
+
+
+# The dtype pandas gives the sum of a column
+def sum_dtype(values: pd.Series) -> np.dtype:
+    return np.dtype("int64") if is_integer_dtype(values) else np.dtype("float64")
+
+
+# --- Loading ---
+
+# Turns date strings into datetimes. Sales files repeat the same few thousand
+# days over millions of rows, so only the distinct strings get parsed (each one
+# just once, even across chunks) and the results are mapped back onto the rows.
+# The format is detected once from a sample and then used for a fixed-format parse.
+class DateParser:
+    def __init__(self):
+        self.format = None
+        self.known = {}
+
+    def detect_format(self, sample: pd.Series) -> Optional[str]:
+        for fmt in DATE_FORMATS:
+            try:
+                pd.to_datetime(sample, format=fmt)
+                return fmt
+            except (ValueError, TypeError):
+                continue
+        return None
+
+    def parse(self, values: pd.Series) -> pd.Series:
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        codes, uniques = pd.factorize(values)
+        new = [u for u in uniques if u not in self.known]
+        if new:
+            if self.format is None:
+                self.format = self.detect_format(pd.Series(new[:DATE_SAMPLE_SIZE]))
+            try:
+                parsed = pd.to_datetime(pd.Series(new), format=self.format)
+            except (ValueError, TypeError):
+                # The sample looked fine but some later value doesn't match, so let pandas guess
+                parsed = pd.to_datetime(pd.Series(new), format="mixed")
+            self.known.update(zip(new, parsed.to_numpy()))
+        lookup = np.array([self.known[u] for u in uniques], dtype="datetime64[ns]")
+        dates = np.append(lookup, np.datetime64("NaT"))[codes]  # code -1 (missing) picks the NaT
+        return pd.Series(dates, index=values.index, name=values.name)
+
+
+# Required columns the frame doesn't have (empty when it's a usable sales file)
+def missing_columns(df: pd.DataFrame) -> set:
+    return REQUIRED_COLUMNS - set(df.columns)
+
+
+# Read the CSV and convert types
+def parse_csv(file: IO[bytes], progress: Optional[Progress] = None) -> pd.DataFrame:
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    if size > STREAM_THRESHOLD_MB * 1024 * 1024:
+        df = parse_csv_chunked(file, size, progress)
+    else:
+        df = csv_reader()(file)
+    if not missing_columns(df):
+        compact_sales_frame(df)
+        # Keep rows in date order so date ranges can be found by binary search
+        df = df.sort_values("Date", kind="stable", ignore_index=True)
+    return df
+
+
+# The whole-file reader for the configured backend or CSV_ENGINE
+def csv_reader() -> Callable[[IO[bytes]], pd.DataFrame]:
+    return getattr(backend(), "read_csv", None) or CSV_PARSERS.get(CSV_ENGINE, read_csv_pandas)
+
+
+# Shrink a sales frame in place: categories for text, the smallest integer type
+# for Units Sold and float32 for unit prices when no cent gets lost.
+# The bytes saved are kept in df.attrs["memory_saved"].
+def compact_sales_frame(df: pd.DataFrame) -> None:
+    before = df.memory_usage(deep=True).sum()
+    for col in CATEGORY_COLUMNS:
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+        # Sorted categories keep groupby output in the same order whatever the parser
+        df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    df["Units Sold"] = pd.to_numeric(df["Units Sold"], downcast="integer")
+    for col in UNIT_PRICE_COLUMNS:
+        if df[col].dtype == "float64":
+            small = df[col].astype("float32")
+            if (small.astype("float64") - df[col]).abs().max() < 0.005:
+                df[col] = small
+    after = df.memory_usage(deep=True).sum()
+    df.attrs["memory_saved"] = df.attrs.get("memory_saved", 0) + int(before - after)
+
+
+# Default parser: pandas' C reader, then convert the dates
+def read_csv_pandas(file: IO[bytes]) -> pd.DataFrame:
+    df = pd.read_csv(file)
+    if not missing_columns(df):
+        df["Date"] = DateParser().parse(df["Date"])
+    return df
+
+
+# Types Arrow is told for the date and text columns. Numbers are left for it to
+# infer, which gives the same int64/float64 pandas would (an all-whole-number
+# price column stays int64 with either engine).
+def pyarrow_column_types() -> dict:
+    import pyarrow as pa
+
+    text = pa.dictionary(pa.int32(), pa.string())
+    return {"Date": pa.timestamp("ns"), "Product": text, "Category": text}
+
+
+# Arrow's multithreaded reader. We already know the types of the date and text
+# columns, so hand them over instead of letting Arrow guess.
+def read_csv_pyarrow(file: IO[bytes]) -> pd.DataFrame:
+    from pyarrow import csv as pa_csv
+
+    try:
+        table = pa_csv.read_csv(file, convert_options=pa_csv.ConvertOptions(column_types=pyarrow_column_types()))
+    except ValueError:
+        # Data doesn't fit (a date format Arrow can't read, a column that changes type...), use pandas instead
+        file.seek(0)
+        return read_csv_pandas(file)
+    # Numbers come out as plain numpy columns and text as categoricals
+    return table.to_pandas()
+
+
+CSV_PARSERS = {
+    "pandas": read_csv_pandas,
+    "pyarrow": read_csv_pyarrow,
+}
+
+
+# Shrink one chunk as soon as it's read so we never hold the raw text of the whole file
+def compact_chunk(chunk: pd.DataFrame, date_parser: DateParser) -> pd.DataFrame:
+    if not missing_columns(chunk):
+        chunk["Date"] = date_parser.parse(chunk["Date"])
+        compact_sales_frame(chunk)
+    return chunk
+
+
+# Glue chunks together, merging the categories each chunk found
+def concat_chunks(chunks: list) -> pd.DataFrame:
+    merged = {}
+    for col in CATEGORY_COLUMNS:
+        if all(col in c.columns and isinstance(c[col].dtype, pd.CategoricalDtype) for c in chunks):
+            merged[col] = union_categoricals([c[col] for c in chunks], ignore_order=True)
+    df = pd.concat([c.drop(columns=list(merged)) for c in chunks], ignore_index=True)
+    for col, values in merged.items():
+        df[col] = pd.Categorical(values)
+    return df
+
+
+# Rough number of rows in a CSV of `size` bytes, from the line length in its
+# first MB. file.tell() is no use for progress: the parser reads far ahead.
+def estimate_rows(file: IO[bytes], size: int) -> int:
+    head = file.read(1024 * 1024)
+    file.seek(0)
+    return max(int(size * head.count(b"\n") / max(len(head), 1)), 1)
+
+
+# pandas' C reader, STREAM_CHUNK_ROWS rows at a time
+def read_chunks_pandas(file: IO[bytes]) -> Iterable[pd.DataFrame]:
+    return pd.read_csv(file, chunksize=STREAM_CHUNK_ROWS)
+
+
+# Arrow's streaming reader (with the same column types as read_csv_pyarrow),
+# its record batches glued into frames of about STREAM_CHUNK_ROWS rows
+def read_chunks_pyarrow(file: IO[bytes]) -> Iterable[pd.DataFrame]:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+
+    reader = pa_csv.open_csv(file, convert_options=pa_csv.ConvertOptions(column_types=pyarrow_column_types()))
+    batches, rows = [], 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= STREAM_CHUNK_ROWS:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches, rows = [], 0
+    if batches:
+        yield pa.Table.from_batches(batches).to_pandas()
+
+
+CHUNK_READERS = {
+    "pandas": read_chunks_pandas,
+    "pyarrow": read_chunks_pyarrow,
+}
+
+
+# Streaming mode for very large files, with the backend's or CSV_ENGINE's reader, reporting
+# progress after every chunk. The estimate can be off a little, so the bar stops
+# short of 100% until the end.
+def parse_csv_chunked(file: IO[bytes], size: int, progress: Optional[Progress] = None) -> pd.DataFrame:
+    total = estimate_rows(file, size)
+    date_parser = DateParser()
+
+    def read_all(read_chunks):
+        chunks, rows = [], 0
+        for chunk in read_chunks(file):
+            chunks.append(compact_chunk(chunk, date_parser))
+            rows += len(chunk)
+            if progress is not None:
+                progress(min(rows / total, 0.99), rows)
+        return chunks, rows
+
+    read_chunks = getattr(backend(), "read_csv_chunks", None) or CHUNK_READERS.get(CSV_ENGINE, read_chunks_pandas)
+    try:
+        chunks, rows = read_all(read_chunks)
+    except ValueError:
+        if read_chunks is read_chunks_pandas:
+            raise
+        # Data that doesn't fit the engine's column types, start over with pandas
+        file.seek(0)
+        chunks, rows = read_all(read_chunks_pandas)
+    if progress is not None:
+        progress(1.0, rows)
+    # Put the merged category columns back in their original order
+    df = concat_chunks(chunks)[chunks[0].columns]
+    df.attrs["memory_saved"] = sum(c.attrs.get("memory_saved", 0) for c in chunks)
+    return df
+
+
+# Map each product to the (sorted) row positions where it appears.
+# Built once at load, so the product filter never has to look at every row.
+def build_product_rows(df: pd.DataFrame) -> dict:
+    codes = df["Product"].cat.codes.to_numpy()
+    dtype = np.int32 if len(df) < 2**31 else np.int64
+    order = np.argsort(codes, kind="stable").astype(dtype)
+    counts = np.bincount(codes[codes >= 0], minlength=len(df["Product"].cat.categories))
+    # Missing products have code -1 and sort first, skip past them
+    order = order[(codes < 0).sum():]
+    # Shared by every session viewing the dataset, so nobody gets to write to them
+    order.flags.writeable = False
+    bounds = np.cumsum(counts)[:-1]
+    return {product: rows for product, rows, count in
+            zip(df["Product"].cat.categories, np.split(order, bounds), counts) if count > 0}
+
+
+# Pre-aggregate the rows into one line per (Date, Product, Category).
+# Besides the sums and row counts it keeps the largest Revenue and smallest
+# Profit/Loss of each cell (for the best/worst day) and the sums needed to get
+# the Units Sold vs Profit/Loss correlation without going back to the rows.
+# Its size depends on days x products, not on how many transactions there are.
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    if (engine := backend()) is not None:
+        return engine.build_cube(df)
+    units = df["Units Sold"].astype("float64")
+    profit = df["Profit/Loss"].astype("float64")
+    paired = units.notna() & profit.notna()
+    units_p, profit_p = units.where(paired), profit.where(paired)
+    rows = pd.DataFrame({
+        "Date": df["Date"],
+        "Product": df["Product"],
+        "Category": df["Category"],
+        "Revenue": df["Revenue"],
+        "Profit/Loss": df["Profit/Loss"],
+        # Summed as int64: pandas otherwise keeps int8 sums when there's a missing-date group
+        "Units Sold": df["Units Sold"].astype(np.int64) if is_integer_dtype(df["Units Sold"]) else df["Units Sold"],
+        "Rows": np.ones(len(df), dtype=np.int64),
+        "Profit Rows": profit.notna().astype(np.int64),
+        "Max Revenue": df["Revenue"],
+        "Min Profit": df["Profit/Loss"],
+        "Paired Rows": paired.astype(np.int64),
+        "Sum X": units_p,
+        "Sum Y": profit_p,
+        "Sum XX": units_p * units_p,
+        "Sum YY": profit_p * profit_p,
+        "Sum XY": units_p * profit_p,
+    })
+    aggs = {col: "sum" for col in rows.columns[3:]}
+    aggs.update({"Max Revenue": "max", "Min Profit": "min"})
+    return (rows.groupby(["Date", "Product", "Category"], observed=True, dropna=False, sort=True)
+            .agg(aggs).reset_index())
+
+
+# A parsed sales file plus the lookup structures built from it at load time.
+# dataset_store.StoredSales offers the same key/cube/products/bounds/rows/head,
+# so the page works the same on either.
+class SalesData:
+    def __init__(self, df: pd.DataFrame, key: Optional[str] = None):
+        self.df = df
+        self.key = key
+        self.product_rows = {}
+        self.cube = None
+        if not missing_columns(df):
+            self.product_rows = build_product_rows(df)
+            self.cube = build_cube(df)
+
+    @property
+    def products(self) -> list:
+        return list(self.product_rows)
+
+    def bounds(self) -> tuple:
+        return date_bounds(self.df)
+
+    # Raw rows for a date range and products, optionally only some columns
+    def rows(self, start, end, products: Iterable, columns: Optional[list] = None) -> pd.DataFrame:
+        rows = filter_sales(self, start, end, products)
+        return rows if columns is None else rows[columns]
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        return self.df.head(n)
+
+    @property
+    def nbytes(self) -> int:
+        size = int(self.df.memory_usage(deep=True).sum()) + sum(r.nbytes for r in self.product_rows.values())
+        if self.cube is not None:
+            size += int(self.cube.memory_usage(deep=True).sum())
+        return size
+
+
+# Load a sales CSV (a path or an open binary file) into a SalesData
+def load_sales(source: Source, key: Optional[str] = None, progress: Optional[Progress] = None) -> SalesData:
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file:
+            return load_sales(file, key, progress)
+    return SalesData(parse_csv(source, progress), key)
+
+
+# --- Filtering ---
+
+# First and last date of a date-sorted frame (missing dates sort to the end)
+def date_bounds(df: pd.DataFrame) -> tuple:
+    dates = df["Date"].to_numpy()
+    valid = dates.searchsorted(np.datetime64("NaT"), side="left")
+    return dates[0], dates[max(valid - 1, 0)]
+
+
+# Row positions [lo, hi) between start and end (both included) of a date-sorted frame.
+# Two binary searches, no boolean mask over every row.
+def date_positions(df: pd.DataFrame, start, end) -> tuple:
+    dates = df["Date"].to_numpy()
+    lo = dates.searchsorted(np.datetime64(pd.Timestamp(start)), side="left")
+    hi = dates.searchsorted(np.datetime64(pd.Timestamp(end)), side="right")
+    return lo, hi
+
+
+# Rows in the date range for the chosen products. The date range is a contiguous
+# slice; the product filter merges the precomputed row lists of the chosen products.
+def filter_sales(data: SalesData, start, end, products: Iterable) -> pd.DataFrame:
+    df = data.df
+    lo, hi = date_positions(df, start, end)
+    chosen = set(products)
+    if chosen.issuperset(data.product_rows):
+        return df.iloc[lo:hi]
+    parts = []
+    for product in chosen:
+        rows = data.product_rows.get(product)
+        if rows is not None:
+            parts.append(rows[rows.searchsorted(lo):rows.searchsorted(hi)])
+    rows = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+    return df.take(rows)
+
+
+# The part of the cube matching the date range and products
+def filter_cube(data: SalesData, start, end, products: Iterable) -> pd.DataFrame:
+    if (engine := backend()) is not None:
+        return engine.filter_cube(data, start, end, products)
+    cube = data.cube
+    lo, hi = date_positions(cube, start, end)
+    cube = cube.iloc[lo:hi]
+    if not set(products).issuperset(data.products):
+        cube = cube[cube["Product"].isin(products)]
+    return cube
+
+
+# --- KPIs ---
+
+# Average Profit/Loss per product, from the cube sums
+def product_profit_mean(cube: pd.DataFrame) -> pd.Series:
+    if (engine := backend()) is not None:
+        return engine.product_profit_mean(cube)
+    per_product = cube.groupby("Product", observed=True)[["Profit/Loss", "Profit Rows"]].sum()
+    return per_product["Profit/Loss"] / per_product["Profit Rows"].replace(0, np.nan)
+
+
+# Pearson correlation of Units Sold and Profit/Loss, from the totals of the cube's sum columns
+def units_profit_corr(totals: pd.Series) -> float:
+    n = totals["Paired Rows"]
+    if n < 2:
+        return np.nan
+    sx, sy = totals["Sum X"], totals["Sum Y"]
+    cov = totals["Sum XY"] - sx * sy / n
+    var_x = totals["Sum XX"] - sx * sx / n
+    var_y = totals["Sum YY"] - sy * sy / n
+    if var_x <= 0 or var_y <= 0:
+        return np.nan
+    return cov / np.sqrt(var_x * var_y)
+
+
+# Every headline number the page shows for the filtered data
+@dataclass
+class SalesSummary:
+    total_revenue: float
+    total_profit: float
+    total_units: int
+    best_day: pd.Timestamp
+    worst_day: pd.Timestamp
+    units_profit_corr: float
+
+
+# Work out all the headline numbers in one go: one sum over all the cube's
+# sum columns, one argmax and one argmin. Everything else reads the result.
+def summarize(cube: pd.DataFrame) -> SalesSummary:
+    sum_columns = ["Revenue", "Profit/Loss", "Units Sold", "Paired Rows", "Sum X", "Sum Y", "Sum XX", "Sum YY", "Sum XY"]
+    totals = cube[sum_columns].sum()
+    return SalesSummary(
+        total_revenue=totals["Revenue"],
+        total_profit=totals["Profit/Loss"],
+        total_units=int(totals["Units Sold"]),
+        best_day=cube["Date"].iloc[cube["Max Revenue"].argmax()],
+        worst_day=cube["Date"].iloc[cube["Min Profit"].argmin()],
+        units_profit_corr=units_profit_corr(totals),
+    )
+
+
+# --- Chart data ---
+
+# Revenue per day
+def sales_trend(cube: pd.DataFrame) -> pd.DataFrame:
+    if (engine := backend()) is not None:
+        return engine.sales_trend(cube)
+    return cube.groupby("Date")["Revenue"].sum().reset_index()
+
+
+# The n products with the most revenue, best first
+def top_products(cube: pd.DataFrame, n: int = 5) -> pd.DataFrame:
+    if (engine := backend()) is not None:
+        return engine.top_products(cube, n)
+    return cube.groupby("Product", observed=True)["Revenue"].sum().reset_index().sort_values(by="Revenue", ascending=False).head(n)
+
+
+# Revenue per category
+def category_revenue(cube: pd.DataFrame) -> pd.DataFrame:
+    if (engine := backend()) is not None:
+        return engine.category_revenue(cube)
+    return cube.groupby("Category", observed=True)["Revenue"].sum().reset_index()
+
+
+# Largest-Triangle-Three-Buckets: pick n points that keep the visual shape of the
+# line. First and last points always stay; every bucket in between keeps the
+# point making the biggest triangle with the previous pick and the next bucket's average.
+def lttb_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    picked = np.empty(n, dtype=np.int64)
+    picked[0], picked[-1] = 0, size - 1
+    prev = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else size
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        areas = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        prev = start + int(areas.argmax())
+        picked[i + 1] = prev
+    return picked
+
+
+# Min/max bucketing: keep the lowest and highest point of each of n/2 buckets,
+# so every peak and dip survives.
+def minmax_indices(y: np.ndarray, n: int) -> np.ndarray:
+    size = len(y)
+    if n >= size or n < 2:
+        return np.arange(size)
+    picked = []
+    for bucket in np.array_split(np.arange(size), n // 2):
+        values = y[bucket]
+        picked.extend({bucket[values.argmin()], bucket[values.argmax()]})
+    return np.unique(np.array(picked, dtype=np.int64))
+
+
+# Thin a time series (sorted by date) down to the point budget
+def downsample_trend(trend: pd.DataFrame, y: str, max_points: int = TREND_MAX_POINTS,
+                     method: str = TREND_DOWNSAMPLE) -> pd.DataFrame:
+    if method == "off" or len(trend) <= max_points:
+        return trend
+    values = trend[y].to_numpy(dtype="float64", na_value=0.0)
+    if method == "minmax":
+        picked = minmax_indices(values, max_points)
+    else:
+        picked = lttb_indices(trend["Date"].to_numpy().astype("int64").astype("float64"), values, max_points)
+    return trend.iloc[picked]
+
+
+# Profit/Loss per day, or per week/month when there would be too many days to draw.
+# Returns the totals and the name of the period used.
+def profit_by_period(cube: pd.DataFrame, max_bars: int = PROFIT_MAX_BARS) -> tuple:
+    daily = daily_profit(cube)
+    if len(daily) <= max_bars:
+        return daily, "Day"
+    weekly = daily.resample("W-MON", label="left", closed="left").sum()
+    if len(weekly) <= max_bars:
+        return weekly, "Week"
+    return daily.resample("MS").sum(), "Month"
+
+
+# Profit/Loss per day, indexed by date
+def daily_profit(cube: pd.DataFrame) -> pd.Series:
+    if (engine := backend()) is not None:
+        return engine.daily_profit(cube)
+    return cube.groupby("Date")["Profit/Loss"].sum()
+
+
+# Green/red bar colours and "$1,234" labels for a set of profit/loss values
+def profit_bar_style(values) -> tuple:
+    values = np.asarray(values, dtype="float64")
+    colors = np.where(values > 0, "green", "red")
+    labels = pd.Series(np.round(values)).map("${:,.0f}".format).to_numpy()
+    return colors, labels
+
+
+# Random sample of about n rows that keeps every product in proportion
+# (each product keeps at least one row). Seeded, so reruns show the same points.
+def stratified_sample(df: pd.DataFrame, n: int, seed: int = 0) -> pd.DataFrame:
+    if len(df) <= n:
+        return df
+    codes = df["Product"].cat.codes.to_numpy()
+    order = np.lexsort((np.random.default_rng(seed).random(len(df)), codes))
+    sizes = np.bincount(codes + 1)
+    quota = np.maximum(1, np.ceil(sizes * n / len(df))).astype(np.int64)
+    starts = np.cumsum(sizes) - sizes
+    sorted_codes = codes[order] + 1
+    rank = np.arange(len(df)) - starts[sorted_codes]
+    keep = np.sort(order[rank < quota[sorted_codes]])
+    return df.iloc[keep]
+
+
+# Units Sold vs Profit/Loss as a 2D histogram: (counts, x bin centres, y bin centres)
+def density_bins(df: pd.DataFrame, bins: int = 60) -> tuple:
+    x = df["Units Sold"].to_numpy(dtype="float64", na_value=np.nan)
+    y = df["Profit/Loss"].to_numpy(dtype="float64", na_value=np.nan)
+    ok = ~(np.isnan(x) | np.isnan(y))
+    counts, x_edges, y_edges = np.histogram2d(x[ok], y[ok], bins=bins)
+    return counts, (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2
+
+
+# --- Summary and tips ---
+
+# The chatbot's rundown of the filtered data (markdown)
+def summary_text(summary: SalesSummary, top: pd.DataFrame) -> str:
+    return """
+        Hey there! Here’s a quick rundown of your sales:
+        - You’ve made **${:,.2f}** in total sales. Nice work!
+        - Your total profit (or loss) is **${:,.2f}**. {}
+        - Your star product is **{}**, raking in **${:,.2f}**.
+        - Your best sales day was **{}**—what happened there? Let’s do more of that!
+        - Watch out for **{}**—it was your toughest day profit-wise.
+        """.format(
+        summary.total_revenue,
+        summary.total_profit,
+        "That’s a win!" if summary.total_profit > 0 else "Let’s turn that around!",
+        top.iloc[0]["Product"],
+        top.iloc[0]["Revenue"],
+        summary.best_day.strftime("%Y-%m-%d"),
+        summary.worst_day.strftime("%Y-%m-%d")
+    )
+
+
+# Advice for the filtered data (markdown, one entry per tip)
+def sales_tips(cube: pd.DataFrame, summary: SalesSummary) -> list:
+    tips = []
+    if summary.total_profit < 0:
+        tips.append("- **Ouch, you’re losing money!** Check products with big losses (red bars) and see if costs are too high.")
+    profit_mean = product_profit_mean(cube)
+    if profit_mean.min() < 0:
+        losing_products = profit_mean[lambda x: x < 0].index.tolist()
+        tips.append(f"- **Heads up!** These products are losing money on average: {', '.join(losing_products)}. Maybe tweak pricing?")
+    if summary.units_profit_corr < 0.3:
+        tips.append("- **Selling more isn’t always better!** Focus on high-profit items (check the scatter plot).")
+    return tips
+
+
+# --- Chatbot ---
+
+# Per-day totals of the filtered data, for the chatbot's date questions.
+# A single day is a dict lookup; a date range is two binary searches and a
+# difference of running totals.
+class DailyIndex:
+    COLUMNS = ["Revenue", "Profit/Loss", "Units Sold"]
+
+    def __init__(self, cube: pd.DataFrame):
+        daily = cube.groupby("Date")[self.COLUMNS].sum()
+        self.dates = daily.index.to_numpy()
+        self.positions = {pd.Timestamp(d): i for i, d in enumerate(self.dates)}
+        self.totals = daily.to_numpy(dtype="float64")
+        self.running = np.vstack([np.zeros(len(self.COLUMNS)), np.cumsum(self.totals, axis=0)])
+
+    def _as_dict(self, values) -> dict:
+        return dict(zip(self.COLUMNS, values))
+
+    def on(self, date) -> dict:
+        i = self.positions.get(pd.Timestamp(date).normalize())
+        return self._as_dict(self.totals[i] if i is not None else np.zeros(len(self.COLUMNS)))
+
+    def between(self, start, end) -> dict:
+        lo = self.dates.searchsorted(np.datetime64(pd.Timestamp(start)), side="left")
+        hi = self.dates.searchsorted(np.datetime64(pd.Timestamp(end)), side="right")
+        return self._as_dict(self.running[max(hi, lo)] - self.running[lo])
+
+
+# Questions are turned into a SalesQuery (what to add up, what to group by,
+# which dates and names to keep, how many results) and answered from the cube.
+# Whole words only (an "s" on the end is fine), so "learn" isn't "earn"
+METRIC_WORDS = [
+    ("Profit/Loss", ("profit", "loss", "losses", "margin", "earn", "earned", "earnings")),
+    ("Units Sold", ("unit", "quantity", "quantities", "volume", "items sold")),
+    ("Revenue", ("sales", "revenue", "sold", "made", "money", "income", "turnover")),
+]
+MONTHS = {name: i for i, name in enumerate(
+    ["january", "february", "march", "april", "may", "june", "july",
+     "august", "september", "october", "november", "december"], start=1)}
+MONTHS.update({name[:3]: i for name, i in list(MONTHS.items())}, sept=9)
+# A month name or abbreviation as a whole word, longest first ("march" before "mar")
+MONTH_PATTERN = "|".join(sorted(MONTHS, key=len, reverse=True))
+BUCKET_WORDS = {"day": "D", "daily": "D", "week": "W", "weekly": "W", "month": "M", "monthly": "M"}
+BUCKET_FREQ = {"D": "D", "W": "W-MON", "M": "MS"}
+BUCKET_FORMAT = {"D": "%Y-%m-%d", "W": "week of %Y-%m-%d", "M": "%B %Y"}
+QUERY_MAX_LINES = 20
+
+
+@dataclass(frozen=True)
+class SalesQuery:
+    metric: str = "Revenue"
+    group_by: Optional[str] = None       # "Product", "Category" or "Date"
+    bucket: Optional[str] = None         # "D", "W" or "M" when grouping by Date
+    top_k: Optional[int] = None
+    ascending: bool = False
+    start: Optional[pd.Timestamp] = None
+    end: Optional[pd.Timestamp] = None
+    month: Optional[int] = None          # a month named without a year; the year comes from the data
+    products: tuple = ()
+    categories: tuple = ()
+
+
+# Turn a question into a SalesQuery, or None if it doesn't look like one we can answer.
+# `products` and `categories` are the names in the data, so questions can mention them.
+def parse_question(question: str, products: Iterable = (), categories: Iterable = ()) -> Optional[SalesQuery]:
+    q = question.lower().strip(" ?!.")
+    found = False
+    fields = {}
+
+    # Names first, then take them out so "Category 01" doesn't read as "by category"
+    # (and a product called "Top Seller" doesn't read as a top-k)
+    patterns = {name: r"\b" + re.escape(str(name).lower()) + r"\b" for name in (*products, *categories)}
+    fields["products"] = tuple(p for p in products if re.search(patterns[p], q))
+    fields["categories"] = tuple(c for c in categories if re.search(patterns[c], q))
+    for name in sorted(fields["products"] + fields["categories"], key=lambda n: -len(str(n))):
+        q = re.sub(patterns[name], " ", q)
+
+    for metric, words in METRIC_WORDS:
+        if any(re.search(r"\b" + word + r"s?\b", q) for word in words):
+            fields["metric"] = metric
+            found = True
+            break
+
+    top = re.search(r"\b(top|best|highest|most|bottom|worst|lowest|least)\s*(\d+)?\b", q)
+    if top:
+        fields["ascending"] = top.group(1) in ("bottom", "worst", "lowest", "least")
+        fields["top_k"] = int(top.group(2)) if top.group(2) else None
+        found = True
+
+    if re.search(r"\bcategor(y|ies)\b", q):
+        fields["group_by"] = "Category"
+    elif re.search(r"\bproducts?\b", q):
+        fields["group_by"] = "Product"
+    else:
+        bucket = re.search(r"\b(by|per|each|which|what)\s+(day|week|month)s?\b|\b(daily|weekly|monthly)\b", q)
+        if bucket:
+            fields["group_by"] = "Date"
+            fields["bucket"] = BUCKET_WORDS[bucket.group(2) or bucket.group(3)]
+        elif top and re.search(r"\b(day|week|month)s?\b", q):
+            fields["group_by"] = "Date"
+            fields["bucket"] = BUCKET_WORDS[re.search(r"\b(day|week|month)s?\b", q).group(1)]
+    if "group_by" in fields:
+        found = True
+        if fields.get("top_k") is None and top:
+            fields["top_k"] = 1 if re.search(r"\b(product|category|day|week|month)\b", q) else 5
+
+    between = re.search(r"\b(?:between|from)\s+(.+?)\s+(?:and|to)\s+(.+)$", q)
+    month = re.search(r"\bin\s+(" + MONTH_PATTERN + r")\b\.?(?:\s+(\d{4}))?\b", q)
+    year = re.search(r"\bin\s+(\d{4})\b", q)
+    on = re.search(r"\bon\s+(.+)$", q)
+    try:
+        if between:
+            fields["start"] = pd.Timestamp(between.group(1).strip())
+            fields["end"] = pd.Timestamp(between.group(2).strip())
+        elif month and month.group(2):
+            fields["start"] = pd.Timestamp(int(month.group(2)), MONTHS[month.group(1)], 1)
+            fields["end"] = fields["start"] + pd.offsets.MonthEnd(0)
+        elif month:
+            fields["month"] = MONTHS[month.group(1)]
+        elif year:
+            fields["start"] = pd.Timestamp(int(year.group(1)), 1, 1)
+            fields["end"] = pd.Timestamp(int(year.group(1)), 12, 31)
+        elif on:
+            fields["start"] = fields["end"] = pd.Timestamp(on.group(1).strip()).normalize()
+    except (ValueError, TypeError):
+        return None
+    found = found or any(k in fields for k in ("start", "month"))
+
+    if not found:
+        return None
+    return SalesQuery(**fields)
+
+
+# Run a query against the (already filtered) cube. Returns a Series of totals
+# per group, or a single number when the query has no group-by.
+def run_query(cube: pd.DataFrame, query: SalesQuery):
+    if query.start is not None:
+        lo, hi = date_positions(cube, query.start, query.end)
+        cube = cube.iloc[lo:hi]
+    elif query.month is not None:
+        months = cube["Date"].dt.month == query.month
+        if months.any():
+            # A month without a year means its most recent occurrence in the data
+            year = cube.loc[months, "Date"].dt.year.max()
+            lo, hi = date_positions(cube, pd.Timestamp(year, query.month, 1),
+                                    pd.Timestamp(year, query.month, 1) + pd.offsets.MonthEnd(0))
+            cube = cube.iloc[lo:hi]
+        else:
+            cube = cube.iloc[:0]
+    if query.products:
+        cube = cube[cube["Product"].isin(query.products)]
+    if query.categories:
+        cube = cube[cube["Category"].isin(query.categories)]
+
+    if query.group_by is None:
+        return cube[query.metric].sum()
+    if query.group_by == "Date":
+        totals = cube.groupby(pd.Grouper(key="Date", freq=BUCKET_FREQ[query.bucket]))[query.metric].sum()
+    else:
+        totals = cube.groupby(query.group_by, observed=True)[query.metric].sum()
+    if query.top_k is not None:
+        totals = totals.sort_values(ascending=query.ascending, kind="stable").head(query.top_k)
+    return totals
+
+
+def format_amount(metric: str, value: float) -> str:
+    return f"{value:,.0f} units" if metric == "Units Sold" else f"${value:,.2f}"
+
+
+# Put a query result into words
+def describe_answer(query: SalesQuery, result) -> str:
+    what = {"Revenue": "sales", "Profit/Loss": "profit/loss", "Units Sold": "units sold"}[query.metric]
+    if query.start is not None:
+        when = (f" on {query.start:%Y-%m-%d}" if query.start == query.end
+                else f" between {query.start:%Y-%m-%d} and {query.end:%Y-%m-%d}")
+    elif query.month is not None:
+        when = f" in {pd.Timestamp(2000, query.month, 1):%B}"
+    else:
+        when = ""
+    names = ", ".join(str(n) for n in query.products + query.categories)
+    about = f" for {names}" if names else ""
+    if query.group_by is None:
+        return f"Your total {what}{about}{when} is **{format_amount(query.metric, result)}**."
+    if len(result) == 0:
+        return f"I didn’t find any {what}{about}{when} with the current filters."
+    label = {"Product": "product", "Category": "category"}.get(query.group_by)
+    if label is None:
+        label = {"D": "day", "W": "week", "M": "month"}[query.bucket]
+    if len(result) != 1 or not query.top_k:
+        label = "categories" if label == "category" else label + "s"
+    rank = ("Bottom" if query.ascending else "Top") + f" {len(result)} " if query.top_k else ""
+    lines = [f"{rank or 'All '}{label} by {what}{about}{when}:"]
+    for i, (name, value) in enumerate(result.head(QUERY_MAX_LINES).items(), start=1):
+        if query.group_by == "Date":
+            name = name.strftime(BUCKET_FORMAT[query.bucket])
+        lines.append(f"{i}. **{name}**: {format_amount(query.metric, value)}")
+    if len(result) > QUERY_MAX_LINES:
+        lines.append(f"...and {len(result) - QUERY_MAX_LINES:,} more.")
+    return "\n".join(lines)
+
+
+# Answer a chatbot question about the filtered cube (markdown).
+# `daily` and `run` let the caller plug in cached versions of the per-day index
+# and of run_query; by default they're built on the spot.
+def answer_question(question: str, cube: pd.DataFrame,
+                    daily: Optional[Callable[[], DailyIndex]] = None,
+                    run: Optional[Callable[[SalesQuery], object]] = None) -> str:
+    daily = daily or (lambda: DailyIndex(cube))
+    run = run or (lambda query: run_query(cube, query))
+    question = question.lower()
+    if "best product" in question:
+        top = top_products(cube, 1)
+        return f"Your best product is **{top.iloc[0]['Product']}** with **${top.iloc[0]['Revenue']:,.2f}** in sales!"
+    query = parse_question(question, cube["Product"].cat.categories, cube["Category"].cat.categories)
+    # The per-day index only answers plain sales totals (or dates the parser couldn't
+    # read, to say so); anything about profit, units, names or groups is a query
+    plain = query is None or (query.metric == "Revenue" and query.group_by is None
+                              and not query.products and not query.categories)
+    if plain and "how much" in question and "between" in question and " and " in question:
+        try:
+            start, end = question.split("between")[-1].split(" and ")[:2]
+            start = pd.to_datetime(start.strip(" ?"))
+            end = pd.to_datetime(end.strip(" ?"))
+            totals = daily().between(start, end)
+            return (f"Between {start:%Y-%m-%d} and {end:%Y-%m-%d}, you made **${totals['Revenue']:,.2f}** "
+                    f"(profit/loss **${totals['Profit/Loss']:,.2f}**, {totals['Units Sold']:,.0f} units).")
+        except (ValueError, TypeError):
+            return "Sorry, I couldn’t read those dates. Try something like 'How much between 2024-01-01 and 2024-01-31?'"
+    on = re.search(r"\bon\s+(.+)$", question)
+    if plain and "how much" in question and on:
+        try:
+            date = pd.to_datetime(on.group(1).strip(" ?"))
+            revenue = daily().on(date)["Revenue"]
+            return f"On {date:%Y-%m-%d}, you made **${revenue:,.2f}**."
+        except (ValueError, TypeError):
+            return "Sorry, I couldn’t find that date. Try something like 'How much on 2024-01-01?'"
+    if query is None:
+        return ("I’m not sure how to answer that yet! Try asking about your best product, sales on a specific date "
+                "or something like 'top 3 categories by profit in March'.")
+    return describe_answer(query, run(query))
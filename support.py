@@ -0,0 +1,230 @@
+"""Caching, hashing and timing helpers for the sales dashboard.
+
+None of this needs pandas, numpy or plotly, so the page can set up its caches
+and profiler and show the upload box before any of the heavy modules load.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Small LRU cache bounded by total size, where `sizeof` says how big each value is.
+# A value bigger than the whole budget isn't kept at all.
+# Values handed out from here are shared, so treat them as read-only.
+class LRUCache:
+    def __init__(self, max_size: int, sizeof: Callable[[object], int]):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.used = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: Hashable, value) -> None:
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.used -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.used += size
+            # Drop the least recently used entries until we fit
+            while self.used > self.max_size:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.used -= old_size
+
+
+# Look key up in cache, calling build() to make (and store) the value on a miss
+def get_or_build(cache: LRUCache, key: Hashable, build: Callable[[], object]):
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.put(key, value)
+    return value
+
+
+# One shared copy of each dataset for the whole process, keyed by content hash.
+# Sessions ("holders") take a reference with acquire(); a holder has at most one
+# dataset, so acquiring another (or release()) drops the old reference. Streamlit
+# doesn't say when a session goes away, so a reference also lapses after
+# `lease_seconds` without a rerun. A dataset nobody references is kept for
+# `idle_seconds` in case it's opened again, and is dropped sooner if unreferenced
+# datasets add up to more than `max_size`. Referenced datasets are never dropped.
+# Values are shared between sessions: treat them as read-only.
+class DatasetRegistry:
+    def __init__(self, sizeof: Callable[[object], int], max_size: int,
+                 idle_seconds: float = 600, lease_seconds: float = 1800):
+        self.sizeof = sizeof
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.lease_seconds = lease_seconds
+        self._entries = OrderedDict()  # key -> [value, size, last_used]
+        self._holders = {}  # holder -> (key, last_seen)
+        self._building = {}  # key -> lock, so each dataset is only built once at a time
+        self._lock = threading.Lock()
+
+    # The dataset for key, building it with build() if nobody has it yet
+    def acquire(self, key: Hashable, holder: Hashable, build: Callable[[], object]):
+        with self._lock:
+            self._holders[holder] = (key, time.monotonic())
+            value = self._touch(key)
+            build_lock = self._building.setdefault(key, threading.Lock()) if value is None else None
+        if value is None:
+            with build_lock:
+                with self._lock:
+                    value = self._touch(key)
+                if value is None:
+                    value = build()
+                    with self._lock:
+                        self._entries[key] = [value, self.sizeof(value), time.monotonic()]
+            with self._lock:
+                self._building.pop(key, None)
+        self.sweep()
+        return value
+
+    def release(self, holder: Hashable) -> None:
+        with self._lock:
+            self._holders.pop(holder, None)
+        self.sweep()
+
+    # Expire lapsed references, then drop idle and over-budget unreferenced datasets
+    def sweep(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for holder, (_, last_seen) in list(self._holders.items()):
+                if now - last_seen > self.lease_seconds:
+                    del self._holders[holder]
+            held = {key for key, _ in self._holders.values()}
+            unheld = [key for key in self._entries if key not in held]  # least recently used first
+            unheld_size = sum(self._entries[key][1] for key in unheld)
+            for key in unheld:
+                _, size, last_used = self._entries[key]
+                if now - last_used > self.idle_seconds or unheld_size > self.max_size:
+                    del self._entries[key]
+                    unheld_size -= size
+
+    # One dict per dataset: key, size, how many sessions hold it and how long since it was used
+    def stats(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            counts = {}
+            for key, _ in self._holders.values():
+                counts[key] = counts.get(key, 0) + 1
+            return [{"key": key, "size_mb": size / 1e6, "refs": counts.get(key, 0), "idle_s": now - last_used}
+                    for key, (_, size, last_used) in self._entries.items()]
+
+    def _touch(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry[2] = time.monotonic()
+        self._entries.move_to_end(key)
+        return entry[0]
+
+
+# Short hash of a file's bytes, used to recognise the same upload again
+def content_hash(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+# --- Instrumentation ---
+
+# How long one section of the page took, the CPU time the whole process used
+# meanwhile (so the worker threads of pyarrow, DuckDB and Polars count, and so
+# does other sessions' work) and how much memory it needed on top of what was
+# already allocated (None when memory isn't being traced)
+@dataclass(frozen=True)
+class StageTiming:
+    stage: str
+    wall_ms: float
+    cpu_ms: float
+    peak_mb: Optional[float]
+    started_at: float
+
+
+# tracemalloc traces the whole process, so it's only on while some traced stage
+# is running: the first one to start switches it on, the last one to end switches
+# it off (unless it was already on before, e.g. from PYTHONTRACEMALLOC)
+_trace_lock = threading.Lock()
+_trace_users = 0
+_trace_owned = False
+
+
+def _begin_trace() -> None:
+    global _trace_users, _trace_owned
+    with _trace_lock:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _trace_owned = True
+        _trace_users += 1
+
+
+def _end_trace() -> None:
+    global _trace_users, _trace_owned
+    with _trace_lock:
+        _trace_users -= 1
+        if _trace_users == 0 and _trace_owned:
+            tracemalloc.stop()
+            _trace_owned = False
+
+
+# Times named sections with `with profiler.stage("filter"): ...` and keeps the
+# latest StageTiming per section in `timings` (pass in a dict to keep them across
+# runs). A disabled profiler does nothing. Memory is measured with tracemalloc,
+# which slows down every allocation in the process while a traced stage runs.
+# The peak is process-wide too: stages shouldn't nest when memory is traced, and
+# stages running at the same time in other sessions count towards each other's peak.
+class StageProfiler:
+    def __init__(self, enabled: bool = True, trace_memory: bool = True, timings: Optional[dict] = None):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.timings = {} if timings is None else timings
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        if self.trace_memory:
+            _begin_trace()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        started_at = time.time()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak_mb = None
+            if self.trace_memory:
+                peak_mb = max(tracemalloc.get_traced_memory()[1] - base, 0) / 1e6
+                _end_trace()
+            timing = StageTiming(name, wall * 1000, cpu * 1000, peak_mb, started_at)
+            self.timings[name] = timing
+            logger.info("stage %s", json.dumps(asdict(timing)))
+
+    # One dict per stage, in the order they last ran
+    def records(self) -> list:
+        return [asdict(t) for t in sorted(self.timings.values(), key=lambda t: t.started_at)]
+
+    # The records as JSON lines, for log shippers
+    def to_json_lines(self) -> str:
+        return "".join(json.dumps(record) + "\n" for record in self.records())